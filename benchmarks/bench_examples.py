@@ -0,0 +1,121 @@
+"""
+Benchmark the extraction of examples from dictionary entries.
+
+Synthetic entries citing the given number of examples (drawn from a smaller number of
+distinct texts, as examples are usually cited in several entries) are passed through
+`sfm_lib.ExampleExtractor`, once with the content-based example IDs memoized and once
+computing them anew for each example.  `Example.id` is also timed on its own.  Garbage
+collection is paused while timing.
+
+    python benchmarks/bench_examples.py --examples 100000 --texts 300
+"""
+import argparse
+import io
+import random
+import time
+from contextlib import contextmanager
+
+from pydictionaria import example, sfm_lib
+from pydictionaria.example import Example
+from pydictionaria.util import paused_gc
+
+# The memoized function computing content-based example IDs.
+CONTENT_ID = example._content_id
+
+WORDS = ['dog', 'water', 'eat', 'house', 'tree', 'fire', 'stone', 'bird', 'fish', 'moon']
+
+
+def make_entries(count, texts, seed=1):
+    """Return entries citing `count` examples in total, three per entry."""
+    rng = random.Random(seed)
+    entries = []
+    for i in range(0, count, 3):
+        pairs = [('lx', f'word{i}'), ('ps', 'n'), ('sn', '1'), ('ge', rng.choice(WORDS))]
+        for _ in range(min(3, count - i)):
+            t = rng.randrange(texts)
+            pairs.extend([
+                ('rf', f'Text {t % 7}'),
+                ('xv', f'the {WORDS[t % 10]} sentence number {t}'),
+                ('xe', f'The {WORDS[t % 10]} translation, number {t}.'),
+            ])
+        pairs.append(('dt', '01/Jan/2000'))
+        entries.append(sfm_lib.Entry(pairs))
+    return entries
+
+
+def make_examples(count, texts, seed=1):
+    rng = random.Random(seed)
+    res = []
+    for _ in range(count):
+        t = rng.randrange(texts)
+        res.append(Example([
+            ('rf', f'Text {t % 7}'),
+            ('tx', f'the {WORDS[t % 10]} sentence number {t}'),
+            ('mb', 'the sentence number'),
+            ('gl', 'DET sentence number'),
+            ('ft', f'The {WORDS[t % 10]} translation, number {t}.'),
+            ('lemma', 'word'),
+        ]))
+    return res
+
+
+@contextmanager
+def memoized(flag):
+    """Compute example IDs with or without memoizing them."""
+    if not flag:
+        example._content_id = CONTENT_ID.__wrapped__
+    try:
+        yield
+    finally:
+        example._content_id = CONTENT_ID
+
+
+def timed(func, repeat=1, setup=None):
+    """Return the best time of `repeat` calls of `func` (on the result of `setup`)."""
+    times = []
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        CONTENT_ID.cache_clear()
+        sfm_lib._normalise_example_value.cache_clear()
+        with paused_gc():
+            start = time.perf_counter()
+            func(arg)
+            times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def extract(entries):
+    extractor = sfm_lib.ExampleExtractor(set(), {}, io.StringIO())
+    for entry in entries:
+        extractor(entry)
+    return extractor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--examples', type=int, default=100000, help='cited examples')
+    parser.add_argument('--texts', type=int, default=300, help='distinct example texts')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    entries = make_entries(args.examples, args.texts)
+    print(f'{len(entries)} entries, {args.examples} examples, {args.texts} texts')
+
+    def ids(examples):
+        for ex in examples:
+            ex.id
+
+    results = {}
+    for flag in (False, True):
+        with memoized(flag):
+            label = 'memoized' if flag else 'not memoized'
+            t = timed(ids, args.repeat, lambda: make_examples(args.examples, args.texts))
+            print(f'{"Example.id, " + label + ":":<38}{t:6.2f}s')
+            t = timed(extract, args.repeat, lambda: make_entries(args.examples, args.texts))
+            print(f'{"ExampleExtractor, " + label + ":":<38}{t:6.2f}s')
+            results[flag] = {k: list(v) for k, v in extract(entries).examples.items()}
+    assert results[False] == results[True]
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark time and peak memory of reading glosses from a flextext file.
+
+A synthetic flextext file of the given size is written to a temporary directory.  Its
+glossed examples are extracted by `flextext.parse_flextext` (which streams the file with
+`iterparse_examples`) and from a document parsed as a whole with `ET.parse`.  Each run
+happens in a fresh process, so that the peak RSS can be compared (Unix only).
+
+    python benchmarks/bench_flextext.py --size 1024
+"""
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from pydictionaria import flextext
+
+MORPH = (
+    '<morph><item type="txt" lang="syn">m{0}</item><item type="gls" lang="en">g{0}</item>'
+    '<item type="msa" lang="en">n</item></morph>'
+    '<morph><item type="txt" lang="syn">-x</item><item type="gls" lang="en">PL</item>'
+    '<item type="gls" lang="de">Pl</item></morph>')
+
+
+def write_text(f, number, phrases):
+    f.write(f'<interlinear-text guid="t{number}">\n')
+    f.write(f'<item type="title" lang="en">English {number}</item>\n')
+    f.write(f'<item type="title" lang="syn">T{number}</item>\n')
+    f.write('<paragraphs>\n')
+    for k in range(phrases):
+        f.write(f'<paragraph><phrases><phrase guid="p{number}.{k}">')
+        f.write(f'<item type="segnum" lang="en">{k + 1}</item><words>')
+        for w in range(4):
+            f.write(f'<word><item type="txt" lang="syn">w{w}</item>')
+            f.write(f'<morphemes>{MORPH.format(k)}</morphemes></word>')
+        f.write('<word><item type="punct" lang="syn">.</item></word>')
+        f.write('</words></phrase></phrases></paragraph>\n')
+    f.write('</paragraphs>\n')
+    f.write(
+        '<languages><language lang="syn" vernacular="true"/>'
+        '<language lang="en"/><language lang="de"/></languages>\n')
+    f.write('</interlinear-text>\n')
+
+
+def make_flextext(path, size, phrases):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('<?xml version="1.0" encoding="utf-8"?>\n<document version="2">\n')
+        number = 0
+        while f.tell() < size:
+            write_text(f, number, phrases)
+            number += 1
+        f.write('</document>\n')
+    return number
+
+
+def read_glosses(path, mode):
+    if mode == 'iterparse':
+        examples = flextext.parse_flextext(path)
+    else:
+        examples = flextext._glossed_examples(
+            flextext.separate_examples(ET.parse(path).getroot()), None)
+    return sum(1 for _ in examples)
+
+
+def run(path, mode):
+    """Read the glosses in a fresh process and return (seconds, examples, peak RSS in MB)."""
+    out = subprocess.run(
+        [sys.executable, __file__, '--run', mode, str(path)],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--size', type=float, default=100, help='file size in MB')
+    parser.add_argument('--phrases', type=int, default=1000, help='phrases per text')
+    parser.add_argument(
+        '--modes', default='iterparse,parse',
+        help='comma-separated list of readers (iterparse, parse)')
+    parser.add_argument('--run', nargs=2, metavar=('MODE', 'PATH'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        mode, path = args.run
+        start = time.perf_counter()
+        count = read_glosses(path, mode)
+        seconds = time.perf_counter() - start
+        # Note: ru_maxrss is given in KiB on Linux.
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(json.dumps([seconds, count, rss]))
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'glosses.flextext'
+        texts = make_flextext(path, int(args.size * 2 ** 20), args.phrases)
+        print(f'{path.stat().st_size / 2 ** 20:.0f} MB, {texts} texts')
+        for mode in args.modes.split(','):
+            seconds, count, rss = run(path, mode)
+            print(f'{mode + ":":<11}{seconds:7.1f}s, {rss:6.0f} MB peak RSS, {count} examples')
+
+
+if __name__ == '__main__':
+    main()
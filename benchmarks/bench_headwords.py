@@ -0,0 +1,92 @@
+"""
+Benchmark `headwords.HeadwordMatcher` against a regular expression alternation.
+
+Synthetic headwords (single and multi-word, plus numbered variants of some of them, as
+created for homonyms by `sfm2cldf.make_id_index`) are searched for in synthetic texts, with
+the automaton and with an alternation of all headwords (longest first, as one would write a
+`link_regex`).  Both must find the same matches.  Garbage collection is paused while timing.
+
+    python benchmarks/bench_headwords.py --headwords 50000
+"""
+import argparse
+import random
+import re
+import time
+
+from pydictionaria.headwords import HeadwordMatcher
+from pydictionaria.util import paused_gc
+
+SYLLABLES = ['ka', 'lo', 'mi', 'tu', 'ne', 'ra', 'so', 'pi', 'wa', 'bé', 'ŋo', 'ʔa']
+
+
+def make_headwords(count, seed=1):
+    """Return `count` distinct headwords and numbered variants of every tenth one."""
+    rng = random.Random(seed)
+
+    def word():
+        return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))
+
+    headwords = set()
+    while len(headwords) < count:
+        headwords.add(word() if rng.random() < 0.8 else f'{word()} {word()}')
+    headwords = sorted(headwords)
+    variants = [f'{hw} {n}' for hw in headwords[::10] for n in (1, 2)]
+    return headwords + variants
+
+
+def make_texts(headwords, count, words=12, seed=2):
+    """Return texts of `words` words, about a quarter of which are headwords."""
+    rng = random.Random(seed)
+    texts = []
+    for _ in range(count):
+        text = []
+        for _ in range(words):
+            if rng.random() < 0.25:
+                text.append(rng.choice(headwords))
+            else:
+                text.append(''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 5))))
+        texts.append(' '.join(text) + '.')
+    return texts
+
+
+def timed(func, repeat=1):
+    """Return the best time of `repeat` calls of `func` and its (last) result."""
+    times = []
+    for _ in range(repeat):
+        with paused_gc():
+            start = time.perf_counter()
+            res = func()
+            times.append(time.perf_counter() - start)
+    return min(times), res
+
+
+def spans(pattern, texts):
+    return [[m.span() for m in pattern.finditer(text)] for text in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--headwords', type=int, default=10000)
+    parser.add_argument('--texts', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    headwords = make_headwords(args.headwords)
+    texts = make_texts(headwords, args.texts)
+    print(f'{len(headwords)} headwords, {len(texts)} texts')
+
+    t, matcher = timed(lambda: HeadwordMatcher(headwords))
+    print(f'build automaton:          {t:7.2f}s')
+    t, regex = timed(lambda: re.compile(r'\b(?:{})\b'.format('|'.join(
+        re.escape(hw) for hw in sorted(headwords, key=len, reverse=True)))))
+    print(f'compile regex:            {t:7.2f}s')
+
+    t_matcher, found = timed(lambda: spans(matcher, texts), args.repeat)
+    t_regex, expected = timed(lambda: spans(regex, texts), args.repeat)
+    assert found == expected
+    for label, t in [('automaton', t_matcher), ('regex', t_regex)]:
+        print(f'{label + ":":<26}{t:7.2f}s ({t / len(texts) * 1e6:.0f}us per text)')
+
+
+if __name__ == '__main__':
+    main()
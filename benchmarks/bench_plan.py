@@ -0,0 +1,95 @@
+"""
+Benchmark `sfm2cldf.ConversionPlan` against looking up properties through `ChainMap`s.
+
+Synthetic entries are run through the per-entry steps, which look up markers in the
+``md.json`` properties, once with the properties with their defaults filled in by
+`_add_property_fallbacks` (i.e. layers of `ChainMap`s) and once with a compiled plan.
+Garbage collection is paused while timing.
+
+    python benchmarks/bench_plan.py --entries 200000
+"""
+import argparse
+import random
+import time
+
+from pydictionaria import sfm2cldf
+from pydictionaria.sfm_lib import Entry
+from pydictionaria.util import paused_gc
+
+PROPERTIES = {
+    'entry_map': {'lx': 'Headword', 'zz': 'Custom'},
+    'sense_map': {'de': 'Description', 'yy': 'Other'},
+    'sources': {'src': 'lx'},
+    'cross_references': ['cf'],
+    'flexref_map': {'Synonym': 'sy', 'Antonym': 'an'},
+}
+MARKERS = ['lx', 'hm', 'ps', 'ge', 'de', 'zz', 'src', 'cf', 'sy', 'nt', 'xv', 'xe', 'dt']
+FLEX_REFS = ['Synonym', 'Antonym', 'syn', 'cf', 'Unknown']
+
+
+def make_entries(count, seed=1):
+    rng = random.Random(seed)
+    entries = []
+    for i in range(count):
+        pairs = [(marker, f'value {i}') for marker in rng.sample(MARKERS, 8)]
+        for _ in range(4):
+            pairs.extend([('lf', rng.choice(FLEX_REFS)), ('lv', f'word{i}'), ('le', '')])
+        entries.append(Entry(pairs))
+    return entries
+
+
+def timed(func, repeat=1):
+    """Return the best time of `repeat` calls of `func` and its (last) result."""
+    times = []
+    for _ in range(repeat):
+        with paused_gc():
+            start = time.perf_counter()
+            res = func()
+            times.append(time.perf_counter() - start)
+    return min(times), res
+
+
+def lookup_markers(mapping, entries):
+    return [[mapping.get(marker) for marker, _ in entry] for entry in entries]
+
+
+def preprocess(flexref_map, entries):
+    return [list(sfm2cldf.preprocess_flex_crossrefs(flexref_map, e)) for e in entries]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    entries = make_entries(args.entries)
+    props = sfm2cldf._add_property_fallbacks(PROPERTIES)
+    plan = sfm2cldf.ConversionPlan.from_properties(PROPERTIES)
+    print(f'{len(entries)} entries')
+
+    for label, func in [
+        ('marker lookup', lambda m: lookup_markers(m['entry_map'], entries)),
+        ('preprocess_flex_crossrefs', lambda m: preprocess(m['flexref_map'], entries)),
+    ]:
+        t_props, expected = timed(lambda: func(props), args.repeat)
+        t_plan, res = timed(
+            lambda: func({
+                'entry_map': plan.entry_table.mapping, 'flexref_map': plan.flexref_map}),
+            args.repeat)
+        assert res == expected
+        for name, t in [('ChainMaps', t_props), ('plan', t_plan)]:
+            print(f'{label + ", " + name + ":":<38}{t / len(entries) * 1e6:6.2f}us per entry')
+
+    calls = 1000
+    t, _ = timed(lambda: [
+        sfm2cldf._get_crossref_markers(sfm2cldf._add_property_fallbacks(PROPERTIES))
+        for _ in range(calls)])
+    print(f'{"fallbacks and cross references:":<38}{t / calls * 1e6:6.2f}us per call')
+    t, _ = timed(lambda: [sfm2cldf.ConversionPlan.from_properties(PROPERTIES)
+                          for _ in range(calls)])
+    print(f'{"compiling a plan:":<38}{t / calls * 1e6:6.2f}us per call')
+
+
+if __name__ == '__main__':
+    main()
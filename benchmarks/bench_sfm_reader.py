@@ -0,0 +1,106 @@
+"""
+Benchmark `pydictionaria.sfm_reader` against `clldutils.sfm.SFM.read`.
+
+A synthetic MDF export of the given size is written to a temporary directory, then read
+with both readers (which must yield the same entries) and with `sfm_lib.Database`, with
+and without a cache.  Garbage collection is paused while timing.
+
+    python benchmarks/bench_sfm_reader.py --size 50
+"""
+import argparse
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from clldutils.sfm import SFM
+
+from pydictionaria.sfm2cldf import DEFAULT_ENTRY_SEP, DEFAULT_MARKER_MAP
+from pydictionaria.sfm_lib import Database
+from pydictionaria.sfm_reader import read_entries
+from pydictionaria.util import paused_gc
+
+SYLLABLES = ['ka', 'lo', 'mi', 'tu', 'ne', 'ra', 'so', 'pi', 'wa', 'bé', 'ŋo', 'ʔa']
+WORDS = ['dog', 'water', 'eat', 'house', 'tree', 'fire', 'stone', 'bird', 'fish', 'moon']
+
+
+def make_entry(rng, i):
+    def word():
+        return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(1, 3)))
+
+    lines = [f'\\lx {word()}', f'\\hm {i % 3 + 1}', '\\ps n', f'\\lc {word()}']
+    for sn in range(rng.randint(1, 3)):
+        lines.extend([
+            f'\\sn {sn + 1}',
+            f'\\d_Eng {rng.choice(WORDS)} ; {rng.choice(WORDS)}',
+            f'\\g_Eng {rng.choice(WORDS)}',
+            f'\\sd {rng.choice(WORDS)}',
+            f'\\xv {word()} {word()} {word()}',
+            f'\\x_Eng the {rng.choice(WORDS)} and the {rng.choice(WORDS)}',
+            f'\\nt a note\n  continued on the next line {i}',
+        ])
+    lines.append(f'\\dt 01/Jan/{2000 + i % 20}')
+    return '\n'.join(lines)
+
+
+def make_sfm(path, size, seed=1):
+    rng = random.Random(seed)
+    written = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\\_sh v3.0  400  MDF 4.0\n\n')
+        i = 0
+        while written < size:
+            entry = make_entry(rng, i) + '\n\n'
+            f.write(entry)
+            written += len(entry.encode('utf-8'))
+            i += 1
+    return i
+
+
+def timed(func, repeat=1):
+    """Return the best time of `repeat` calls of `func` and its (last) result."""
+    times = []
+    for _ in range(repeat):
+        with paused_gc():
+            start = time.perf_counter()
+            res = func()
+            times.append(time.perf_counter() - start)
+    return min(times), res
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--size', type=float, default=20, help='file size in MB')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'db.sfm'
+        count = make_sfm(path, int(args.size * 2 ** 20))
+        print(f'{path.stat().st_size / 2 ** 20:.1f} MB, {count} entries')
+        kw = {'marker_map': DEFAULT_MARKER_MAP, 'entry_sep': DEFAULT_ENTRY_SEP}
+
+        def read_clldutils():
+            sfm = SFM()
+            sfm.read(path, **kw)
+            return sfm
+
+        t_old, old = timed(read_clldutils, args.repeat)
+        t_new, new = timed(lambda: list(read_entries(path, **kw)), args.repeat)
+        assert [list(e) for e in old] == [list(e) for e in new]
+        del old, new
+        print(f'tokenise, clldutils.sfm:           {t_old:6.2f}s')
+        print(f'tokenise, sfm_reader:              {t_new:6.2f}s')
+
+        cache_dir = Path(tmp) / 'cache'
+        for label, kw in [
+            ('Database', {}),
+            ('Database, filling the cache', {'cache_dir': cache_dir}),
+            ('Database, from the cache', {'cache_dir': cache_dir}),
+        ]:
+            t, _ = timed(lambda: Database(path, marker_map=DEFAULT_MARKER_MAP, **kw))
+            print(f'{label + ":":<35}{t:6.2f}s')
+
+
+if __name__ == '__main__':
+    main()
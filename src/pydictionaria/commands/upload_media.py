@@ -2,16 +2,28 @@
 Updload media files of a submission to CDSTAR.
 """
 
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import ExitStack
+import copy
+from itertools import islice
+import mimetypes
 import os
 import pathlib
-from contextlib import ExitStack
+import threading
+import time
 
-from cdstarcat.catalog import Catalog
+from cdstarcat.catalog import Bitstream, Catalog, Object
 from cldfbench.cli_util import with_dataset, add_dataset_spec
 from clldutils.clilib import PathType
-from clldutils.path import md5
+from pycdstar.api import Cdstar
+
+from pydictionaria.util import ChecksumCache, MediaCatalog
 
-from pydictionaria.util import MediaCatalog
+DEFAULT_WORKERS = 4
+# Number of seconds between two checkpoints of the catalogs.
+DEFAULT_CHECKPOINT_INTERVAL = 60
+# Name of the file in the media directory, which caches the checksums of the media files.
+CHECKSUM_CACHE = '.checksums.marshal'
 
 
 def register(parser):
@@ -32,9 +44,220 @@ def register(parser):
             help=f'CDSTAR service {kw.lower()}',
             default=os.environ.get(f'CDSTAR_{kw}'),
         )
+    parser.add_argument(
+        '--workers',
+        default=DEFAULT_WORKERS,
+        help='number of files to upload at the same time',
+        type=int)
+    parser.add_argument(
+        '--checkpoint-interval',
+        default=DEFAULT_CHECKPOINT_INTERVAL,
+        help='number of seconds between saving the progress of the upload to cdstar.json',
+        type=float)
+    parser.add_argument(
+        '--dry-run',
+        default=False,
+        help='only report the files that would be uploaded',
+        action='store_true')
+
+
+def save_catalog(catalog):
+    """
+    Write a `cdstarcat.catalog.Catalog` to disk.
+
+    The file is replaced atomically, so that an interrupted run never leaves a truncated
+    catalog behind.
+    """
+    # Note: The catalog is written when its context exits - so we let a copy, pointing to a
+    # temporary file next to the catalog, do the writing.
+    tmp = copy.copy(catalog)
+    tmp.path = catalog.path.with_name(f'{catalog.path.stem}.tmp{catalog.path.suffix}')
+    with tmp:
+        pass
+    os.replace(tmp.path, catalog.path)
+
+
+class CdstarUploader:
+    """
+    Upload files to CDSTAR, registering the created objects in a `cdstarcat` catalog.
+
+    `upload` may be called from several threads at once:  Each thread creates objects through
+    its own catalog with its own API client, and the shared catalog - which is not thread-safe -
+    is guarded by a lock.
+
+    :param catalog: A `cdstarcat.catalog.Catalog` instance.
+    """
+    def __init__(self, catalog, cdstar_url=None, cdstar_user=None, cdstar_pwd=None):
+        self.catalog = catalog
+        self._api_kw = dict(service_url=cdstar_url, user=cdstar_user, password=cdstar_pwd)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # Note: `Catalog.md5_to_object` is recomputed from all objects on every access.
+        self._md5_to_object = {
+            checksum: objs[0] for checksum, objs in catalog.md5_to_object.items()}
+
+    def _catalog(self):
+        """Return the catalog, through which the current thread creates objects."""
+        if not hasattr(self._local, 'catalog'):
+            catalog = copy.copy(self.catalog)
+            catalog.objects = {}
+            catalog.api = Cdstar(**self._api_kw)
+            self._local.catalog = catalog
+        return self._local.catalog
+
+    def upload(self, fname, checksum, metadata):
+        """
+        Upload a file, unless the catalog already contains an object for its content.
+
+        :return: The `cdstarcat.catalog.Object` for the file.
+        """
+        with self._lock:
+            obj = self._md5_to_object.get(checksum)
+        if obj is None:
+            catalog = self._catalog()
+            [(_, _, obj)] = catalog.create(fname, metadata, filter_=None)
+            # The thread's catalog is kept empty, so that looking up checksums in it is cheap.
+            catalog.remove(obj)
+            with self._lock:
+                self.catalog[obj.id] = obj
+                self._md5_to_object[checksum] = obj
+        return obj
+
+    def checkpoint(self):
+        """Write the catalog to disk."""
+        with self._lock:
+            save_catalog(self.catalog)
+
+
+class DryRunUploader:
+    """
+    Stand-in for `CdstarUploader`, which does not upload anything.
 
+    The objects returned for the files are made up, with object IDs derived from the
+    checksums of the files.
+    """
+    def upload(self, fname, checksum, metadata):
+        stat = fname.stat()
+        mimetype = mimetypes.guess_type(str(fname), strict=False)[0] \
+            or 'application/octet-stream'
+        objid = checksum.upper()
+        objid = '-'.join([objid[:5], objid[5:9], objid[9:13], objid[13:17], objid[17]])
+        modified = int(stat.st_mtime * 1000)
+        return Object(
+            objid,
+            [Bitstream(fname.name, stat.st_size, mimetype, checksum, modified, modified)],
+            dict(metadata))
+
+    def checkpoint(self):
+        pass
+
+
+def _files_to_upload(file_dir, mcat, checksums, workers):
+    seen = set()
+    fnames = (fname for fname in sorted(file_dir.iterdir()) if fname.is_file())
+    for fname, checksum in checksums.map(fnames, workers=workers):
+        if checksum not in mcat.items and checksum not in seen:
+            seen.add(checksum)
+            yield fname, checksum
+
+
+def upload_files(uploader, files, metadata, workers=DEFAULT_WORKERS):
+    """
+    Upload files concurrently.
+
+    At most `2 * workers` files are queued for upload at a time, while the next ones are
+    hashed, and the upload of each file is reported as soon as it is done.  If an upload
+    fails, no more uploads are started and the error is raised once the running uploads are
+    done.
+
+    :param uploader: A `CdstarUploader` or `DryRunUploader` instance.
+    :param files: Iterable of pairs (path, md5 checksum) - which may compute the checksums \
+    lazily.
+    :param metadata: Callable returning the CDSTAR metadata for a path.
+    :return: Generator of pairs (path, `cdstarcat.catalog.Object`) in order of completion.
+    """
+    files = iter(files)
+    pending, errors = {}, []
+    with ThreadPoolExecutor(workers) as pool:
+        while True:
+            if not errors:
+                for fname, checksum in islice(files, 2 * workers - len(pending)):
+                    future = pool.submit(uploader.upload, fname, checksum, metadata(fname))
+                    pending[future] = fname
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                fname = pending.pop(future)
+                if future.exception() is not None:
+                    errors.append(future.exception())
+                else:
+                    yield fname, future.result()
+    if errors:
+        raise errors[0]
+
+
+def upload_dir(
+    file_dir,
+    mcat,
+    uploader,
+    dataset_id,
+    workers=DEFAULT_WORKERS,
+    checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL,
+    log=None,
+    checksums=None,
+    save_catalogs=True,
+):
+    """
+    Upload the files in a directory, which are not yet listed in the `MediaCatalog` `mcat`.
+
+    Every `checkpoint_interval` seconds, the catalogs are written to disk, so that an
+    interrupted upload can be resumed.
+
+    :param checksums: `pydictionaria.util.ChecksumCache` to look up the checksums of the \
+    files in.
+    :param save_catalogs: Whether to write the catalogs to disk at checkpoints - the \
+    checksums are saved in any case.
+    """
+    checksums = checksums or ChecksumCache()
+
+    def metadata(fname):
+        return {
+            'collection': 'dictionaria',
+            'path': str(fname.relative_to(file_dir)),
+            'dictionary': dataset_id,
+        }
+
+    last_checkpoint = time.monotonic()
+    for fname, obj in upload_files(
+            uploader,
+            _files_to_upload(file_dir, mcat, checksums, workers),
+            metadata,
+            workers=workers):
+        if log:
+            log.info('{}: {}'.format(fname, obj.id))
+        mcat.add(obj, sid=dataset_id, type=fname.parent.name, fname=fname.name)
+        if time.monotonic() - last_checkpoint >= checkpoint_interval:
+            if save_catalogs:
+                uploader.checkpoint()
+                mcat.save()
+            checksums.save()
+            last_checkpoint = time.monotonic()
+
+
+def _upload(args, dataset, file_dir, cdstar_json, checksums):
+    kw = dict(
+        workers=args.workers,
+        checkpoint_interval=args.checkpoint_interval,
+        log=args.log,
+        checksums=checksums)
+    if args.dry_run:
+        # Neither the CDSTAR catalog nor cdstar.json are changed.
+        mcat = MediaCatalog(cdstar_json.parent)
+        upload_dir(
+            file_dir, mcat, DryRunUploader(), dataset.id, save_catalogs=False, **kw)
+        return
 
-def _upload(args, dataset, file_dir, cdstar_json):
     with ExitStack() as stack:
         mcat = MediaCatalog(cdstar_json.parent)
         stack.enter_context(mcat)
@@ -43,24 +266,22 @@ def _upload(args, dataset, file_dir, cdstar_json):
             cdstar_url=args.cdstar_url,
             cdstar_user=args.cdstar_user,
             cdstar_pwd=args.cdstar_pwd)
-        stack.enter_context(cat)
-        for fname in file_dir.iterdir():
-            if fname.is_file() and md5(fname) not in mcat.items:
-                md = {
-                    'collection': 'dictionaria',
-                    'path': str(fname.relative_to(file_dir)),
-                    'dictionary': dataset.id,
-                }
-                _, _, obj = next(cat.create(fname, md, filter_=lambda _: True))
-                mcat.add(obj, sid=dataset.id, type=fname.parent.name, fname=fname.name)
+        stack.callback(save_catalog, cat)
+        uploader = CdstarUploader(
+            cat,
+            cdstar_url=args.cdstar_url,
+            cdstar_user=args.cdstar_user,
+            cdstar_pwd=args.cdstar_pwd)
+        upload_dir(file_dir, mcat, uploader, dataset.id, **kw)
 
 
 def upload(dataset, args):
     cdstar_json = dataset.etc_dir / 'cdstar.json'
-    for mtype in ['audio', 'image', 'docs']:
-        type_dir = args.media_dir / mtype
-        if type_dir.exists():
-            _upload(args, dataset, type_dir, cdstar_json)
+    with ChecksumCache(args.media_dir / CHECKSUM_CACHE) as checksums:
+        for mtype in ['audio', 'image', 'docs']:
+            type_dir = args.media_dir / mtype
+            if type_dir.exists():
+                _upload(args, dataset, type_dir, cdstar_json, checksums)
 
     args.log.info(args.cdstar_catalog)
 
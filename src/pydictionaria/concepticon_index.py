@@ -0,0 +1,136 @@
+"""
+Compact index of the Concepticon data needed to match glosses to concept sets.
+
+`pyconcepticon.Concepticon.lookup` reads and parses the glosses of all concept sets for
+every lookup.  A `ConcepticonIndex` keeps the parsed glosses (and the gloss and definition
+of each concept set) instead, and can be stored in a cache directory, so that it is loaded
+without touching the Concepticon repository at all.  It can be used in place of the
+Concepticon API by `pydictionaria.sfm_lib.ComparisonMeanings`.
+"""
+import collections
+
+from clldutils.path import md5, Path
+import pyconcepticon
+from pyconcepticon.glosses import parse_gloss
+from pyconcepticon.util import read_dicts
+
+from pydictionaria.util import read_cache, write_cache
+
+# Version of the format of the index; must be increased whenever its content changes.
+INDEX_VERSION = 1
+
+IndexedConceptset = collections.namedtuple('IndexedConceptset', 'id gloss definition')
+
+
+def _mapping_path(repos, language):
+    return Path(repos) / 'mappings' / f'map-{language}.tsv'
+
+
+def _conceptsets_path(repos):
+    return Path(repos) / 'concepticondata' / 'concepticon.tsv'
+
+
+def concepticon_version(concepticon, language='en'):
+    """
+    Return an identifier of the data a Concepticon API (or index) matches glosses with.
+
+    :return: A tuple, or `None` if the version cannot be determined.
+    """
+    if isinstance(concepticon, ConcepticonIndex):
+        return concepticon.version
+    repos = getattr(concepticon, 'repos', None)
+    if not repos:
+        return None
+    mapping, conceptsets = _mapping_path(repos, language), _conceptsets_path(repos)
+    if not mapping.exists() or not conceptsets.exists():
+        return None
+    return (
+        INDEX_VERSION,
+        getattr(pyconcepticon, '__version__', None),
+        language,
+        md5(mapping),
+        md5(conceptsets))
+
+
+class ConcepticonIndex:
+    """
+    Concepticon gloss index, providing `lookup` and `conceptsets` like the Concepticon API.
+
+    :param targets: List of triples (concept set ID, gloss, parsed glosses) of the concept \
+    sets glosses are matched to.
+    :param conceptsets: Dict mapping concept set IDs to `IndexedConceptset` instances.
+    """
+    def __init__(self, targets, conceptsets, language='en', version=None):
+        self.targets = targets
+        self.conceptsets = conceptsets
+        self.language = language
+        self.version = version
+
+    @classmethod
+    def from_concepticon(cls, concepticon, language='en'):
+        """Build the index from a `pyconcepticon.Concepticon` instance."""
+        targets = [
+            (row['ID'], row['GLOSS'], parse_gloss(row['GLOSS'], language=language))
+            for row in read_dicts(_mapping_path(concepticon.repos, language))]
+        conceptsets = {
+            id_: IndexedConceptset(id_, cs.gloss, cs.definition)
+            for id_, cs in concepticon.conceptsets.items()}
+        return cls(
+            targets, conceptsets,
+            language=language, version=concepticon_version(concepticon, language))
+
+    @classmethod
+    def from_repos(cls, repos, cache_dir=None, language='en'):
+        """
+        Load the index for a clone of concepticon-data.
+
+        :param cache_dir: Directory to store the index in.  The index is only rebuilt \
+        when the Concepticon data or the version of `pyconcepticon` change.
+        """
+        concepticon = pyconcepticon.Concepticon(repos)
+        if not cache_dir:
+            return cls.from_concepticon(concepticon, language=language)
+
+        version = concepticon_version(concepticon, language)
+        cache_path = Path(cache_dir) / f'concepticon-{language}.index'
+        data = read_cache(cache_path, version)
+        if data is None:
+            index = cls.from_concepticon(concepticon, language=language)
+            write_cache(cache_path, version, (index.targets, index.conceptsets))
+            return index
+        return cls(*data, language=language, version=version)
+
+    def lookup(self, entries, similarity_level=5):
+        """
+        Match glosses to concept sets (see `pyconcepticon.Concepticon.lookup`).
+
+        As with `pyconcepticon`, each concept set is matched to one gloss at most.
+
+        :returns: `generator` of sets of tuples (searchterm, concepticon_id, \
+        concepticon_gloss, similarity).
+        """
+        entries = list(entries)
+        pairs = []
+        for i, entry in enumerate(entries):
+            for gloss in parse_gloss(entry, language=self.language):
+                for j, (_, _, target_glosses) in enumerate(self.targets):
+                    for target_gloss in target_glosses:
+                        similarity = gloss.similarity(target_gloss)
+                        if similarity and similarity <= similarity_level:
+                            pairs.append((similarity, -target_gloss.frequency, i, j))
+
+        # Go through all matches from best to worst, as
+        # `pyconcepticon.glosses.GlossMapper.best_matches` does.
+        best, consumed = {}, set()
+        for similarity, _, i, j in sorted(pairs, key=lambda p: p[:2]):
+            if i not in best and j not in consumed:
+                best[i] = (j, similarity)
+                consumed.add(j)
+
+        for i, entry in enumerate(entries):
+            if i in best:
+                j, similarity = best[i]
+                id_, gloss, _ = self.targets[j]
+                yield {(entry, id_, gloss.split('///')[0], similarity)}
+            else:
+                yield set()
@@ -1,13 +1,32 @@
+from functools import lru_cache
 from hashlib import md5
+import marshal
 
-from clldutils.sfm import Entry, SFM
+from clldutils.sfm import SFM
 from clldutils.misc import slug
 
+from clldutils.path import Path
+
+from pydictionaria import sfm_reader
+from pydictionaria.sfm_reader import iter_blocks, read_into, split_block
+from pydictionaria.util import IndexedEntry, read_cache, write_cache
+
 
 MULTILINE_MARKERS = {'tx', 'mb', 'gl'}
 
+# Version of the format of cached corpus indexes; must be increased whenever
+# the locations of the utterances change.
+CORPUS_INDEX_VERSION = 1
+
+
+@lru_cache(maxsize=2 ** 16)
+def _content_id(text, translation):
+    # Note: The same example is often cited in many entries, so the same IDs are
+    # computed over and over again.
+    return md5(slug(text + translation).encode('utf')).hexdigest()
 
-class Example(Entry):
+
+class Example(IndexedEntry):
     markers = {
         'ref': 'id',
         'lemma': None,
@@ -38,22 +57,24 @@ class Example(Entry):
     def id(self):
         res = self.get('ref')
         if not res:
-            res = md5(slug((self.text or '') + (self.translation or '')).encode('utf'))\
-                .hexdigest()
-            self.insert(0, ('ref', res))
+            res = _content_id(self.text or '', self.translation or '')
+            # Note: The `ref` takes the place of an empty one or is appended, rather
+            # than inserted at the front, which would shift all other pairs.
+            # `__str__` writes it first either way.
+            self.set('ref', res)
         return res
 
     def set(self, key, value):
         assert (key in self.markers) or (key in self.name_to_marker)
         key = self.name_to_marker.get(key, key)
-        for i, (k, v) in enumerate(self):
-            if k == key:
-                if key == 'lemma':
-                    if not value or not v:
-                        continue
-                    value = f'{v} ; {value}'
-                self[i] = (key, value)
-                break
+        for i in self.positions(key):
+            if key == 'lemma':
+                v = self[i][1]
+                if not value or not v:
+                    continue
+                value = f'{v} ; {value}'
+            self[i] = (key, value)
+            break
         else:
             self.append((key, value))
 
@@ -125,18 +146,209 @@ def concat_multilines(example):
 
 
 class Examples(SFM):
+    """
+    List of examples, which can be looked up by ID (i.e. the value of their `ref` marker).
+
+    The ID index is built the first time it's needed and updated as examples are added
+    or replaced (including by `visit`).  As with a dict built from the list, the last
+    example with a particular ID wins.  Operations, which would make updating it
+    ambiguous (e.g. deleting or reordering examples), have it rebuilt on the next lookup.
+    """
     def __init__(self, *args, **kwargs):
         self._cached_ids = None
         super().__init__(*args, **kwargs)
 
     def read(self, filename, **kwargs):
-        return SFM.read(self, filename, entry_impl=Example, **kwargs)
+        read_into(self, filename, entry_impl=Example, **kwargs)
 
     def get(self, item):
         if self._cached_ids is None:
             self._cached_ids = {entry.get('ref'): entry for entry in self}
         return self._cached_ids.get(item)
 
+    def _index(self, entry):
+        if self._cached_ids is not None:
+            self._cached_ids[entry.get('ref')] = entry
+
+    def _reindex(self, old, old_ref, new, new_ref):
+        """Update the index after `old` (with ID `old_ref`) was replaced by `new`."""
+        if self._cached_ids is None:
+            return
+        is_last = self._cached_ids.get(old_ref) is old
+        if old_ref == new_ref:
+            if is_last:
+                self._cached_ids[new_ref] = new
+        elif not is_last and new_ref not in self._cached_ids:
+            self._cached_ids[new_ref] = new
+        else:
+            self._cached_ids = None
+
+    def append(self, entry):
+        super().append(entry)
+        self._index(entry)
+
+    def extend(self, entries):
+        if self._cached_ids is None:
+            super().extend(entries)
+            return
+        entries = list(entries)
+        super().extend(entries)
+        for entry in entries:
+            self._index(entry)
+
+    def __iadd__(self, entries):
+        self.extend(entries)
+        return self
+
+    def insert(self, index, entry):
+        if self._cached_ids is not None \
+                and index < len(self) and entry.get('ref') in self._cached_ids:
+            self._cached_ids = None
+        super().insert(index, entry)
+        self._index(entry)
+
+    def __setitem__(self, index, value):
+        if isinstance(index, slice):
+            self._cached_ids = None
+            super().__setitem__(index, value)
+            return
+        old = self[index]
+        super().__setitem__(index, value)
+        if self._cached_ids is not None:
+            self._reindex(old, old.get('ref'), value, value.get('ref'))
+
+    def visit(self, visitor):
+        if self._cached_ids is None:
+            super().visit(visitor)
+            return
+        # Note: Visitors may change the ID of an example in place.
+        for i, entry in enumerate(self):
+            old_ref = entry.get('ref')
+            new = visitor(entry) or entry
+            super().__setitem__(i, new)
+            self._reindex(entry, old_ref, new, new.get('ref'))
+
+    def __delitem__(self, index):
+        self._cached_ids = None
+        return super().__delitem__(index)
+
+    def __imul__(self, n):
+        self._cached_ids = None
+        return super().__imul__(n)
+
+    def pop(self, *args):
+        self._cached_ids = None
+        return super().pop(*args)
+
+    def remove(self, entry):
+        self._cached_ids = None
+        return super().remove(entry)
+
+    def clear(self):
+        self._cached_ids = None
+        return super().clear()
+
+    def sort(self, **kw):
+        self._cached_ids = None
+        return super().sort(**kw)
+
+    def reverse(self):
+        self._cached_ids = None
+        return super().reverse()
+
+
+class CorpusIndex:
+    """
+    Examples from ELAN corpus files, which are only parsed when they are looked up.
+
+    Like `Examples.get`, `get` returns the last example with the given ID.
+
+    :param paths: List of the paths of the corpus files.
+    :param locations: Dict mapping utterance IDs to triples (index of the file in `paths`, \
+    start, end), where `start` and `end` are the byte offsets of the utterance in the file.
+    """
+    entry_sep = '\\utterance_id'
+    marker_map = {
+        'utterance_id': 'ref',
+        'utterance': 'tx',
+        'gramm_units': 'mb',
+        'rp_gloss': 'gl',
+    }
+
+    def __init__(self, paths, locations):
+        self.paths = paths
+        self.locations = locations
+        self._examples = {}
+
+    @classmethod
+    def _first_line_ref(cls, block):
+        """Return the utterance ID of a block, if it fits on the first line."""
+        match = sfm_reader.MARKER_LINE_PATTERN.match(cls.entry_sep + block)
+        if not match or match.group('marker') != 'utterance_id':
+            return None
+        end = block.find('\n')
+        if end != -1:
+            next_marker = sfm_reader.MARKER_LINE_PATTERN.search(block, end + 1)
+            rest = block[end + 1:next_marker.start() if next_marker else len(block)]
+            if sfm_reader.CONTINUATION_LINE_PATTERN.search(rest):
+                return None
+        return match.group('value').strip()
+
+    @classmethod
+    def _scan(cls, paths):
+        locations = {}
+        for i, path in enumerate(paths):
+            for start, end, block in iter_blocks(path, cls.entry_sep):
+                if not block.strip():
+                    continue
+                ref = cls._first_line_ref(block)
+                if not ref:
+                    pairs = split_block(cls.entry_sep + block, marker_map=cls.marker_map)
+                    if not pairs:
+                        continue
+                    ref = next((value for marker, value in pairs if marker == 'ref'), None)
+                locations[ref] = (i, start, end)
+        return locations
+
+    @classmethod
+    def from_dir(cls, dir_, cache_dir=None):
+        """
+        Index the utterances in the `*.eaf.sfm` files in a directory.
+
+        :param cache_dir: Directory to cache the index in.  The cache is invalidated when \
+        any of the files (i.e. its modification time or size) change.
+        """
+        paths = [str(path) for path in dir_.glob('*.eaf.sfm')]
+        if not cache_dir:
+            return cls(paths, cls._scan(paths))
+
+        key = [CORPUS_INDEX_VERSION]
+        for path in paths:
+            stat = Path(path).stat()
+            key.append((path, stat.st_mtime_ns, stat.st_size))
+        cache_path = Path(cache_dir) / 'corpus-{}.marshal'.format(
+            md5(str(Path(dir_).resolve()).encode('utf-8')).hexdigest())
+        locations = read_cache(cache_path, key, serializer=marshal)
+        if locations is None:
+            locations = cls._scan(paths)
+            write_cache(cache_path, key, locations, serializer=marshal)
+        return cls(paths, locations)
+
+    def get(self, item):
+        if item in self._examples:
+            return self._examples[item]
+        location = self.locations.get(item)
+        if location is None:
+            return None
+        i, start, end = location
+        with open(self.paths[i], 'rb') as f:
+            f.seek(start)
+            block = f.read(end - start).decode('utf-8')
+        block = block.replace('\r\n', '\n').replace('\r', '\n')
+        example = self._examples[item] = Example(
+            split_block(self.entry_sep + block, marker_map=self.marker_map))
+        return example
+
 
 class Corpus:
     """
@@ -145,20 +357,19 @@ class Corpus:
     http://www.mpi.nl/corpus/html/elan/ch04s03s02.html#Sec_Exporting_a_document_to_Toolbox
     """
     def __init__(self, examples):
+        """
+        :param examples: `Examples` or `CorpusIndex` instance.
+        """
         self.examples = examples
 
     @classmethod
-    def from_dir(cls, dir_):
-        examples = Examples()
-        marker_map = {
-            'utterance_id': 'ref',
-            'utterance': 'tx',
-            'gramm_units': 'mb',
-            'rp_gloss': 'gl',
-        }
-        for path in dir_.glob('*.eaf.sfm'):
-            examples.read(path, marker_map=marker_map, entry_sep='\\utterance_id')
-        return cls(examples)
+    def from_dir(cls, dir_, cache_dir=None):
+        """
+        Load the corpus from the `*.eaf.sfm` files in a directory.
+
+        Utterances are only read from the files when they are looked up (see `CorpusIndex`).
+        """
+        return cls(CorpusIndex.from_dir(dir_, cache_dir=cache_dir))
 
     def get(self, key):
         res = self.examples.get(key)
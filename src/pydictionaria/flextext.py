@@ -1,6 +1,21 @@
-from collections import defaultdict
+import codecs
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+from itertools import islice
+import marshal
+import mmap
+import re
 import xml.etree.ElementTree as ET
 
+from clldutils.path import md5, Path
+
+from pydictionaria.util import read_cache, write_cache
+
+# Version of the format of cached glosses; must be increased whenever the
+# extraction results change.
+CACHE_VERSION = 1
+
 
 def get_item(node, key, default=None):
     for item in node.iter('item'):
@@ -9,11 +24,27 @@ def get_item(node, key, default=None):
     return default
 
 
+def _get_header_item(node, key, default=None):
+    """Like `get_item`, but only scan the whole subtree if `node` itself has no such item.
+
+    Items describing a text or phrase come directly below its node, so there
+    is no need to look at the items of all the words and morphemes within.
+    """
+    for item in node.findall('item'):
+        if item.attrib.get('type') == key:
+            return item.text
+    return get_item(node, key, default)
+
+
 def _extract_languages(node):
     languages = set()
     vernacular = None
 
-    for language in node.iter('language'):
+    languages_node = node.find('languages')
+    if languages_node is None:
+        languages_node = node
+
+    for language in languages_node.iter('language'):
         lang_name = language.attrib.get('lang')
         if not lang_name:
             continue
@@ -26,19 +57,19 @@ def _extract_languages(node):
     return languages, vernacular
 
 
-def _extract_text_id(node, vernacular):
+def _text_id_from_items(item_index, vernacular):
     abbr_items = [
         item.text
-        for item in node.iter('item')
-        if item.text and item.attrib.get('type') == 'title-abbreviation']
+        for item in item_index.get_items('title-abbreviation')
+        if item.text]
 
     if abbr_items:
         return abbr_items[0]
 
     title_items = [
         (item.attrib.get('lang', ''), item.text)
-        for item in node.iter('item')
-        if item.text and item.attrib.get('type') == 'title']
+        for item in item_index.get_items('title')
+        if item.text]
 
     if not title_items:
         return None
@@ -50,6 +81,71 @@ def _extract_text_id(node, vernacular):
     return title_items[0][1]
 
 
+def _extract_text_id(node, vernacular):
+    # Look at the text's own items first and only fall back to all items
+    # within the text if there is no title among them.
+    return (
+        _text_id_from_items(ItemIndex(node.findall('item')), vernacular)
+        or _text_id_from_items(ItemIndex(node.iter('item')), vernacular))
+
+
+def _separate_text_examples(text, log=None):
+    """Iterate over examples contained in an interlinear text."""
+    languages, vernacular = _extract_languages(text)
+    if not languages:
+        if log:
+            log.warn("Missing languages in interlinear text '{}'".format(
+                text.attrib.get('guid', '???')))
+        return
+    if not vernacular:
+        if log:
+            log.warn("Missing vernacular in interlinear text '{}'".format(
+                text.attrib.get('guid', '???')))
+        return
+
+    text_id = _extract_text_id(text, vernacular)
+    if not text_id:
+        if log:
+            log.warn("Missing title in interlinear text '{}'".format(
+                text.attrib.get('guid', '???')))
+        return
+
+    paragraphs = text.find('paragraphs')
+    if not paragraphs:
+        if log:
+            log.warn("No paragraphs in interlinear text '{}'".format(
+                text.attrib.get('guid', '???')))
+        return
+
+    for paragraph in paragraphs.iter('paragraph'):
+        phrases = paragraph.find('phrases')
+        if not phrases:
+            if log:
+                log.warn("No phrases in paragraph '{}'".format(
+                    paragraph.attrib.get('guid', '???')))
+            continue
+
+        examples = defaultdict(list)
+        for phrase in phrases.iter('phrase'):
+            segnum = _get_header_item(phrase, 'segnum')
+            if not segnum:
+                if log:
+                    log.warn("Missing segnum in phrase '{}'".format(
+                        phrase.attrib.get('guid', '???')))
+                continue
+
+            prefix = segnum.split('.')[0] or segnum
+            examples[prefix].append(phrase)
+
+        for segnum, phrases in examples.items():
+            yield {
+                'text_id': text_id,
+                'segnum': segnum,
+                'languages': languages,
+                'vernacular': vernacular,
+                'example': phrases}
+
+
 def separate_examples(document, log=None):
     """Iterate over examples contained in flextext XML document."""
     if not document.find('interlinear-text'):
@@ -58,59 +154,62 @@ def separate_examples(document, log=None):
         return
 
     for text in document.iter('interlinear-text'):
-        languages, vernacular = _extract_languages(text)
-        if not languages:
-            if log:
-                log.warn("Missing languages in interlinear text '{}'".format(
-                    text.attrib.get('guid', '???')))
-            continue
-        if not vernacular:
-            if log:
-                log.warn("Missing vernacular in interlinear text '{}'".format(
-                    text.attrib.get('guid', '???')))
-            continue
+        yield from _separate_text_examples(text, log)
 
-        text_id = _extract_text_id(text, vernacular)
-        if not text_id:
-            if log:
-                log.warn("Missing title in interlinear text '{}'".format(
-                    text.attrib.get('guid', '???')))
-            continue
 
-        paragraphs = text.find('paragraphs')
-        if not paragraphs:
-            if log:
-                log.warn("No paragraphs in interlinear text '{}'".format(
-                    text.attrib.get('guid', '???')))
+def iterparse_examples(source, log=None):
+    """Iterate over examples contained in a flextext file.
+
+    Yields the same examples as `separate_examples`, but reads the file
+    incrementally: Each child of the document element is dropped once the
+    examples within it have been yielded.  Thus, only one interlinear text is
+    kept in memory at a time (it must be read completely, since the
+    `<languages>` of a text come after its `<paragraphs>`).
+
+    Note: The `phrase` elements of the examples are only detached from the
+    document, not cleared, so examples stay valid after the next one was
+    requested.  Memory is only bounded, if the examples are processed (e.g.
+    with `extract_gloss`) rather than collected.
+    """
+    events = ET.iterparse(source, events=('start', 'end'))
+    _, document = next(events)
+    if document.tag == 'interlinear-text':
+        # The document *is* the text, so there's nothing to drop.
+        for _ in events:
+            pass
+        yield from separate_examples(document, log)
+        return
+
+    # Children of the document read before the first interlinear text.  They
+    # are only processed, once we know the texts aren't empty.
+    pending = []
+    texts_found = False
+    depth = 1
+    for event, elem in events:
+        if event == 'start':
+            depth += 1
+            continue
+        depth -= 1
+        if depth != 1:
             continue
 
-        for paragraph in paragraphs.iter('paragraph'):
-            phrases = paragraph.find('phrases')
-            if not phrases:
-                if log:
-                    log.warn("No phrases in paragraph '{}'".format(
-                        paragraph.attrib.get('guid', '???')))
+        if not texts_found:
+            if elem.tag != 'interlinear-text':
+                pending.append(elem)
                 continue
+            if not elem:
+                break
+            texts_found = True
 
-            examples = defaultdict(list)
-            for phrase in phrases.iter('phrase'):
-                segnum = get_item(phrase, 'segnum')
-                if not segnum:
-                    if log:
-                        log.warn("Missing segnum in phrase '{}'".format(
-                            phrase.attrib.get('guid', '???')))
-                    continue
-
-                prefix = segnum.split('.')[0] or segnum
-                examples[prefix].append(phrase)
+        for child in pending + [elem]:
+            for text in child.iter('interlinear-text'):
+                yield from _separate_text_examples(text, log)
+            document.remove(child)
+        pending = []
 
-            for segnum, phrases in examples.items():
-                yield {
-                    'text_id': text_id,
-                    'segnum': segnum,
-                    'languages': languages,
-                    'vernacular': vernacular,
-                    'example': phrases}
+    if not texts_found:
+        if log:
+            log.warn('XML data does not contain any interlinear texts.')
 
 
 class ItemIndex:
@@ -161,7 +260,7 @@ def _column_name(name, lang):
 def _parse_morph(morph):
     gloss = {}
 
-    item_index = ItemIndex(morph.iter('item'))
+    item_index = ItemIndex(morph.findall('item'))
 
     mb = item_index.get_text('txt')
     puncts = item_index.get_items('punct')
@@ -218,10 +317,211 @@ def merge_glosses(glosses):
     return combo
 
 
-def parse_flextext(file_name, log=None):
-    """Iterate over glossed examples contained in a flextext file."""
-    gloss_db = ET.parse(file_name)
-    for example in separate_examples(gloss_db.getroot(), log):
+# Start and end tags of interlinear texts and of the document element, for
+# locating texts in the raw bytes of a file.  Note: Attribute values may
+# contain `>`.
+_ATTRIBUTES = rb'(?:[ \t\r\n]+[^ \t\r\n=/>]+[ \t\r\n]*=[ \t\r\n]*(?:"[^"]*"|\'[^\']*\'))*[ \t\r\n]*'
+_TEXT_TAG = re.compile(rb'<(/?)interlinear-text[ \t\r\n/>]')
+_TEXT_START_TAG = re.compile(rb'[ \t\r\n]*<interlinear-text' + _ATTRIBUTES + rb'(/?)>')
+_TEXT_END_TAG = re.compile(rb'</interlinear-text[ \t\r\n]*>')
+_DOCUMENT_START_TAG = re.compile(
+    rb'[ \t\r\n]*(?:<\?xml(?P<declaration>' + _ATTRIBUTES + rb')\?>)?'
+    rb'[ \t\r\n]*<document(?P<attributes>' + _ATTRIBUTES + rb')>')
+_DOCUMENT_END_TAG = re.compile(rb'[ \t\r\n]*</document[ \t\r\n]*>[ \t\r\n]*')
+_ENCODING_DECLARATION = re.compile(rb'encoding[ \t\r\n]*=[ \t\r\n]*["\']([^"\']*)')
+
+
+def _is_utf8(declaration):
+    match = _ENCODING_DECLARATION.search(declaration)
+    if not match:
+        return True
+    try:
+        return codecs.lookup(match.group(1).decode('ascii')).name == 'utf-8'
+    except (UnicodeDecodeError, LookupError):
+        return False
+
+
+def _find_text_end(data, start):
+    """Return the end of the interlinear text starting at `start`."""
+    match = _TEXT_START_TAG.match(data, start)
+    depth = 1
+    pos = match.end()
+    if match.group(1):
+        return pos
+    while True:
+        tag = _TEXT_TAG.search(data, pos)
+        if not tag:
+            return None
+        if tag.group(1):
+            match = _TEXT_END_TAG.match(data, tag.start())
+            if not match:
+                return None
+            depth -= 1
+            if depth == 0:
+                return match.end()
+        else:
+            match = _TEXT_START_TAG.match(data, tag.start())
+            if not match:
+                return None
+            if not match.group(1):
+                depth += 1
+        pos = match.end()
+
+
+def find_text_spans(data):
+    """Find the interlinear texts in the raw bytes of a flextext file.
+
+    :return: A list of (start, end) byte offsets of the children of the \
+    document element, or `None`, if the file is not a UTF-8 encoded `<document>` \
+    consisting of nothing but interlinear texts (in which case the texts cannot \
+    be told apart without parsing the whole file).
+    """
+    if data.find(b'<!') != -1:
+        # Comments, CDATA sections or document types may hide or define tags.
+        return None
+    pos = len(codecs.BOM_UTF8) if data[:3] == codecs.BOM_UTF8 else 0
+    match = _DOCUMENT_START_TAG.match(data, pos)
+    if not match \
+            or b'xmlns' in match.group('attributes') \
+            or not _is_utf8(match.group('declaration') or b''):
+        return None
+    pos = match.end()
+    spans = []
+    while not _DOCUMENT_END_TAG.fullmatch(data, pos):
+        match = _TEXT_START_TAG.match(data, pos)
+        if not match:
+            return None
+        start = match.start() + match.group().index(b'<')
+        end = _find_text_end(data, start)
+        if end is None:
+            return None
+        spans.append((start, end))
+        pos = end
+    return spans
+
+
+class _WarningRecorder:
+    """Log, which keeps warnings to replay them later or in another process.
+
+    :param log: Log to pass the warnings on to.
+    """
+
+    def __init__(self, log=None):
+        self.log = log
+        self.warnings = []
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+        if self.log:
+            self.log.warn(msg)
+
+
+def _glossed_examples(examples, log):
+    for example in examples:
         example['example'] = merge_glosses(
             [extract_gloss(e, log) for e in example['example']])
         yield example
+
+
+def _parse_text_span(file_name, start, end):
+    """Extract the glossed examples from one interlinear text of a file.
+
+    :return: A tuple (is_empty, examples, warnings, error), where `error` is the \
+    exception raised while extracting the examples, if any.
+    """
+    with open(file_name, 'rb') as f:
+        f.seek(start)
+        text = ET.fromstring(f.read(end - start))
+    log = _WarningRecorder()
+    examples = []
+    try:
+        for node in text.iter('interlinear-text'):
+            examples.extend(_glossed_examples(_separate_text_examples(node, log), log))
+    except Exception as e:  # Re-raised in the main process.
+        return not text, examples, log.warnings, e
+    return not text, examples, log.warnings, None
+
+
+def _parse_in_parallel(file_name, spans, log, workers):
+    if not spans:
+        if log:
+            log.warn('XML data does not contain any interlinear texts.')
+        return
+    spans = iter(spans)
+    with ProcessPoolExecutor(workers) as pool:
+        # Only keep a few texts in flight, so that the examples of all texts
+        # aren't held in memory at once.
+        futures = deque(
+            pool.submit(_parse_text_span, file_name, *span)
+            for span in islice(spans, 2 * workers))
+        first = True
+        while futures:
+            is_empty, examples, warnings, error = futures.popleft().result()
+            for span in islice(spans, 1):
+                futures.append(pool.submit(_parse_text_span, file_name, *span))
+            if first and is_empty:
+                for future in futures:
+                    future.cancel()
+                if log:
+                    log.warn('XML data does not contain any interlinear texts.')
+                return
+            first = False
+            if log:
+                for msg in warnings:
+                    log.warn(msg)
+            yield from examples
+            if error is not None:
+                raise error
+
+
+def _parse_cached(file_name, log, workers, cache_dir):
+    path = Path(file_name).resolve()
+    key = (CACHE_VERSION, md5(path))
+    cache_path = Path(cache_dir) / '{}-{}.marshal'.format(
+        path.name, hashlib.md5(str(path).encode('utf-8')).hexdigest())
+    cached = read_cache(cache_path, key, serializer=marshal)
+    if cached is not None:
+        examples, warnings = cached
+        if log:
+            for msg in warnings:
+                log.warn(msg)
+        yield from examples
+        return
+
+    recorder = _WarningRecorder(log)
+    examples = []
+    for example in parse_flextext(file_name, recorder, workers=workers):
+        examples.append(example)
+        yield example
+    write_cache(cache_path, key, (examples, recorder.warnings), serializer=marshal)
+
+
+def parse_flextext(file_name, log=None, workers=None, cache_dir=None):
+    """Iterate over glossed examples contained in a flextext file.
+
+    :param workers: Number of processes to extract the glosses of the \
+    interlinear texts in.  The examples and warnings come out in the same order \
+    as when reading the file in a single process.  Files, which are not a plain \
+    list of interlinear texts (see `find_text_spans`), are always read in a \
+    single process.
+    :param cache_dir: Directory to cache the glossed examples in.  The cache is \
+    invalidated when the content of the file changes.  Warnings are replayed \
+    from the cache, but before the first example rather than interleaved with \
+    the examples.
+    """
+    if cache_dir:
+        yield from _parse_cached(file_name, log, workers, cache_dir)
+        return
+    if workers and workers > 1:
+        with open(file_name, 'rb') as f:
+            try:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty file
+                spans = None
+            else:
+                with data:
+                    spans = find_text_spans(data)
+        if spans is not None:
+            yield from _parse_in_parallel(file_name, spans, log, workers)
+            return
+    yield from _glossed_examples(iterparse_examples(file_name, log), log)
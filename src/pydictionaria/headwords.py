@@ -0,0 +1,134 @@
+"""
+Matcher finding known headwords in free text.
+
+Searching for tens of thousands of headwords with a regular expression (i.e. an alternation
+of all headwords) means trying every headword at every position of a text.  Instead, a
+`HeadwordMatcher` compiles the headwords into an Aho-Corasick automaton, which finds all of
+them in a single pass over the text.
+
+The automaton runs on tokens - runs of word characters and single other characters - rather
+than on characters.  Since texts and headwords are split into tokens the same way, a match
+can never start or end in the middle of a word, and scanning a text takes one step per token.
+"""
+from collections import deque
+import itertools
+import re
+
+TOKEN_PATTERN = re.compile(r'\w+|\W')
+WORD_PATTERN = re.compile(r'\w')
+
+
+class HeadwordMatch:
+    """A match of a headword, providing the parts of the `re.Match` API used for links."""
+    __slots__ = ('string', '_start', '_end')
+
+    def __init__(self, string, start, end):
+        self.string = string
+        self._start = start
+        self._end = end
+
+    def group(self):
+        return self.string[self._start:self._end]
+
+    def start(self):
+        return self._start
+
+    def end(self):
+        return self._end
+
+    def span(self):
+        return self._start, self._end
+
+
+class HeadwordMatcher:
+    """
+    Find occurrences of a set of headwords in texts.
+
+    The matcher can be used in place of a compiled regular expression (see `finditer` and
+    `sub`).  Headwords only match whole words, and of overlapping matches the leftmost and -
+    among those - the longest one wins (e.g. `dog 2` rather than `dog`).
+
+    :param headwords: Iterable of strings.  Strings without any word character are ignored.
+    """
+    def __init__(self, headwords):
+        # The states of the automaton are numbered; state 0 is the root.
+        self._goto = [{}]
+        self._depth = [0]
+        self._final = [False]
+        for headword in headwords:
+            if not WORD_PATTERN.search(headword):
+                continue
+            state = 0
+            for token in TOKEN_PATTERN.findall(headword):
+                next_state = self._goto[state].get(token)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][token] = next_state
+                    self._goto.append({})
+                    self._depth.append(self._depth[state] + 1)
+                    self._final.append(False)
+                state = next_state
+            self._final[state] = True
+
+        # `_fail` points to the state for the longest proper suffix of the
+        # tokens leading to a state, `_output` to the nearest final state among
+        # these suffixes (or 0).
+        self._fail = [0] * len(self._goto)
+        self._output = [0] * len(self._goto)
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for token, next_state in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and token not in self._goto[fail]:
+                    fail = self._fail[fail]
+                fail = self._goto[fail].get(token, 0)
+                self._fail[next_state] = fail
+                self._output[next_state] = fail if self._final[fail] else self._output[fail]
+                queue.append(next_state)
+
+    def _matches(self, tokens):
+        goto, fail, final, output, depth = \
+            self._goto, self._fail, self._final, self._output, self._depth
+        state = 0
+        for i, token in enumerate(tokens, start=1):
+            while state and token not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(token, 0)
+            match = state if final[state] else output[state]
+            while match:
+                yield i - depth[match], i
+                match = output[match]
+
+    def finditer(self, string):
+        """
+        Find the non-overlapping occurrences of headwords in a string.
+
+        :return: Generator of `HeadwordMatch` objects.
+        """
+        tokens = TOKEN_PATTERN.findall(string)
+        matches = sorted(self._matches(tokens), key=lambda m: (m[0], -m[1]))
+        if not matches:
+            return
+        offsets = list(itertools.accumulate(map(len, tokens), initial=0))
+        pos = 0
+        for start, end in matches:
+            if start >= pos:
+                yield HeadwordMatch(string, offsets[start], offsets[end])
+                pos = end
+
+    def sub(self, repl, string):
+        """
+        Replace the occurrences of headwords in a string, like `re.Pattern.sub`.
+
+        :param repl: Callable, which is passed a `HeadwordMatch` and returns the replacement.
+        """
+        parts, pos = [], 0
+        for match in self.finditer(string):
+            parts.append(string[pos:match.start()])
+            parts.append(repl(match))
+            pos = match.end()
+        if not parts:
+            return string
+        parts.append(string[pos:])
+        return ''.join(parts)
@@ -1,25 +1,33 @@
-from collections import ChainMap, defaultdict
+from collections import ChainMap, defaultdict, namedtuple
 import copy
 from functools import partial
 from itertools import chain
 import logging
 import os.path
+import pathlib
 import re
 import sys
+import zipfile
 
 from clldutils import sfm
+from clldutils.path import md5
+from csvw.dsv import UnicodeWriter
+from csvw.metadata import Dialect
 
-from pydictionaria import flextext
+from pydictionaria import __version__, flextext
 from pydictionaria.example import Corpus, Examples, concat_multilines
+from pydictionaria.headwords import HeadwordMatcher
 from pydictionaria.sfm_lib import (
     find_duplicate_examples,
     normalize,
     Files,
+    MediaResolver,
     Rearrange,
     ExampleExtractor,
+    VisitorChain,
     EXAMPLE_MARKER_MAP,
 )
-from pydictionaria.util import split_ids
+from pydictionaria.util import ChecksumCache, IndexedEntry, paused_gc, split_ids
 import rfc3986
 
 
@@ -97,12 +105,16 @@ PROPERTY_URLS = {
     'Concepticon_ID': 'http://cldf.clld.org/v1.0/terms.rdf#concepticonReference'}
 
 
-def load_examples(examples_path):
-    """Load examples from a separate SFM file."""
+def load_examples(examples_path, cache_dir=None):
+    """Load examples from a separate SFM file.
+
+    :arg cache_dir: Directory to cache the parsed SFM file in (see
+        `pydictionaria.sfm_reader.read_into`).
+    """
     if not examples_path.exists():
         return None
     examples = Examples()
-    examples.read(examples_path, marker_map={'sf': 'sfx'})
+    examples.read(examples_path, marker_map={'sf': 'sfx'}, cache_dir=cache_dir)
     examples.visit(concat_multilines)
     return examples
 
@@ -154,6 +166,78 @@ def _add_property_fallbacks(props):
     return new_properties
 
 
+class TablePlan(namedtuple(
+        'TablePlan', 'name mapping source_refs crossref_columns')):
+    """How SFM entries are converted into the rows of a CLDF table.
+
+    :arg name: Name of the CLDF table/component.
+    :arg mapping: mapping ``SFM marker`` -> ``CLDF column name``
+    :arg source_refs: mapping of markers, which contain a row's ``Source``, to
+      the column the source refers to
+    :arg crossref_columns: `frozenset` of the CLDF column names, which denote
+      cross references.
+    """
+    __slots__ = ()
+
+
+class ConversionPlan(namedtuple('ConversionPlan', [
+    'properties',
+    'entry_sep', 'entry_id', 'sense_sep', 'example_id', 'gloss_ref',
+    'sources', 'flexref_map', 'crossref_markers',
+    'link_label_marker', 'link_markers', 'labels',
+    'entry_table', 'sense_table', 'example_table',
+])):
+    """``md.json`` properties compiled for the conversion to CLDF.
+
+    The default values are filled in once and all mappings are flattened into
+    plain dicts, so that the per-entry steps of the conversion do not have to
+    look up markers through layers of `ChainMap`s.  Plans can be pickled (e.g.
+    for worker processes) and copied; their mappings must not be changed.
+
+    The functions of this module, which take ``properties``, accept a plan as
+    well, so properties only need to be compiled once.
+    """
+    __slots__ = ()
+
+    @classmethod
+    def from_properties(cls, properties):
+        """Compile ``md.json`` properties (or return them, if they are a plan already)."""
+        if isinstance(properties, cls):
+            return properties
+
+        props = _add_property_fallbacks(properties)
+        crossref_markers = frozenset(_get_crossref_markers(props))
+
+        def table_plan(name, mapping):
+            mapping = dict(mapping)
+            return TablePlan(
+                name,
+                mapping,
+                _source_mapping(props['sources'], mapping),
+                frozenset(c for m, c in mapping.items() if m in crossref_markers))
+
+        return cls(
+            properties=dict(properties),
+            entry_sep=props['entry_sep'],
+            entry_id=props['entry_id'],
+            sense_sep=props['sense_sep'],
+            example_id=props['example_id'],
+            gloss_ref=props.get('gloss_ref'),
+            sources=dict(props['sources']),
+            flexref_map=dict(props['flexref_map']),
+            crossref_markers=crossref_markers,
+            link_label_marker=props['link_label_marker'],
+            link_markers=frozenset(props['process_links_in_markers']),
+            labels=dict(props['labels']),
+            entry_table=table_plan('EntryTable', props['entry_map']),
+            sense_table=table_plan('SenseTable', props['sense_map']),
+            example_table=table_plan('ExampleTable', props['example_map']))
+
+    @property
+    def tables(self):
+        return self.entry_table, self.sense_table, self.example_table
+
+
 def _local_mapping(mapping, marker_set, source_mapping):
     markers = set(mapping.keys()) & marker_set
     mapping = {
@@ -171,36 +255,30 @@ def _local_mapping(mapping, marker_set, source_mapping):
 
 
 def make_spec(properties, marker_set):
-    properties = _add_property_fallbacks(properties)
-
-    source_mapping = properties['sources']
+    plan = ConversionPlan.from_properties(properties)
 
     entry_markers = _local_mapping(
-        properties['entry_map'],
+        plan.entry_table.mapping,
         marker_set,
-        source_mapping)
+        plan.sources)
     # Note: entry_sep is a string like '\\TAG ' (required by clldutils)
-    entry_sep = properties['entry_sep'].strip().lstrip('\\')
-    entry_id = properties['entry_id']
-    link_label_marker = properties['link_label_marker']
+    entry_sep = plan.entry_sep.strip().lstrip('\\')
     entry_markers.update((
-        link_label_marker, entry_sep, entry_id, 'hm', 'sf', 'lc'))
+        plan.link_label_marker, entry_sep, plan.entry_id, 'hm', 'sf', 'lc'))
 
     sense_markers = _local_mapping(
-        properties['sense_map'],
+        plan.sense_table.mapping,
         marker_set,
-        source_mapping)
-    sense_sep = properties['sense_sep']
-    sense_markers.update((sense_sep, 'xref', 'pc'))
+        plan.sources)
+    sense_markers.update((plan.sense_sep, 'xref', 'pc'))
 
     example_markers = _local_mapping(
-        properties['example_map'],
+        plan.example_table.mapping,
         marker_set,
-        source_mapping)
-    example_id = properties['example_id']
-    example_markers.update((example_id, 'sfx'))
-    if 'gloss_ref' in properties:
-        example_markers.add(properties['gloss_ref'])
+        plan.sources)
+    example_markers.update((plan.example_id, 'sfx'))
+    if plan.gloss_ref is not None:
+        example_markers.add(plan.gloss_ref)
 
     return {
         'entry_markers': entry_markers,
@@ -249,6 +327,17 @@ def split_by_pred(pred, iterable, constructor=list):
     return pred_true, pred_false
 
 
+class TableEntry(IndexedEntry):
+    """SFM entry, which ends up as a row in one of the CLDF tables.
+
+    Only the attributes listed in `__slots__` are set, and only where they
+    apply, i.e. `hasattr` tells which kind of row the entry is.
+    """
+    __slots__ = (
+        'id', 'original_id', 'entry_id', 'original_entry_id',
+        'sense_ids', 'media_ids')
+
+
 class IDGenerator:
     """Generator for sequential.
 
@@ -277,7 +366,7 @@ def prepare_examples(example_markers, database):
     example_index = {}
 
     for old_example in database:
-        new_example = sfm.Entry(
+        new_example = TableEntry(
             (marker, content)
             for marker, content in old_example
             if marker in example_markers)
@@ -350,7 +439,7 @@ class EntryExtractor:
         new_entry, rest = split_by_pred(
             lambda pair: pair[0] in self.entry_markers,
             entry,
-            constructor=sfm.Entry)
+            constructor=TableEntry)
         if not new_entry:
             return False
 
@@ -363,7 +452,6 @@ class EntryExtractor:
             entry_id = self._idgen.next_id()
         self._idset.add(entry_id)
 
-        # XXX(johannes): Adding attributes to existing types feels very fragile...
         new_entry.id = entry_id
         new_entry.original_id = original_id
         new_entry.media_ids = []
@@ -403,18 +491,28 @@ class GlossToExMapping:
         return example_id
 
 
-def prepare_glosses(glosses_path, gloss_ref_marker, examples, log):
+def prepare_glosses(
+    glosses_path, gloss_ref_marker, examples, log, workers=None, cache_dir=None,
+):
     """Map glosses from flextext file to examples.
 
+    :arg workers: Number of processes to extract the glosses in (see
+      `pydictionaria.flextext.parse_flextext`).
+    :arg cache_dir: Directory to cache the extracted glosses in (see
+      `pydictionaria.flextext.parse_flextext`).
     :returns: a dictionary, which maps example ids to glosses.
     """
     glosses = {}
     mapping = GlossToExMapping(gloss_ref_marker)
     mapping.add_examples(examples)
-    for gloss in flextext.parse_flextext(str(glosses_path), log):
-        example_id = mapping.get_example_id(gloss['text_id'], gloss['segnum'])
-        if example_id:
-            glosses[example_id] = gloss
+    # Note: Collecting the glosses creates lots of objects, which survive, so
+    # the garbage collector would run over and over again to no avail.
+    with paused_gc():
+        for gloss in flextext.parse_flextext(
+                str(glosses_path), log, workers=workers, cache_dir=cache_dir):
+            example_id = mapping.get_example_id(gloss['text_id'], gloss['segnum'])
+            if example_id:
+                glosses[example_id] = gloss
     return glosses
 
 
@@ -512,7 +610,7 @@ class SenseExtractor:
                         r'\lx %s: sense markers before first \sn: %s',
                         entry.original_entry_id, msg)
                 continue
-            new_sense = sfm.Entry(group)
+            new_sense = TableEntry(group)
             new_sense.id = self._idgen.next_id()
             new_sense.entry_id = entry.entry_id
             new_sense.media_ids = []
@@ -593,24 +691,30 @@ class CaptionFinder:
         # no-op on the actual entry
         return entry
 
+    def merge(self, other):
+        """Add captions found by a copy of this caption finder."""
+        self.captions.update(other.captions)
+
 
 class MediaExtractor:
     """Visitor, which turns media file names into CDSTAR IDs."""
 
-    def __init__(self, tag, id_index, cdstar_items):
+    def __init__(self, tag, resolver):
         """Create media extractor.
 
         :arg tag: marker, which contains the media file name.
-        :arg id_index: dictionary ``filename`` -> ``checksum``
-        :arg cdstar_items: dictionary ``checksum`` -> ``media item``
+        :arg resolver: `pydictionaria.sfm_lib.MediaResolver` for the media
+          catalog.
         """
         self.tag = tag
-        self.id_index = id_index
-        self.cdstar_items = cdstar_items
+        self.resolver = resolver
 
-        self.orphans = set()
         self.files = set()
 
+    @property
+    def orphans(self):
+        return self.resolver.orphans
+
     def __call__(self, entry):
         """Add CDSTAR IDs to `entry.media_ids`.
 
@@ -623,16 +727,7 @@ class MediaExtractor:
                 if not value.strip():
                     continue
 
-                filename = value
-                fileid = value
-
-                if value in self.cdstar_items:
-                    filename = self.cdstar_items[value]['fname']
-                elif value in self.id_index:
-                    fileid = self.id_index[value]
-                else:
-                    self.orphans.add(value)
-
+                filename, fileid = self.resolver.resolve(value)
                 self.files.add((filename, fileid))
                 entry.media_ids.append(fileid)
 
@@ -695,12 +790,14 @@ class CrossRefs:
         self._index = id_index
         self.markers = crossref_markers
 
+    def rewrite(self, value):
+        """Point the references in a marker value to new IDs."""
+        return ' ; '.join(self._index.get(ref, ref) for ref in split_ids(value))
+
     def _process_tag(self, tag, value):
         if tag not in self.markers:
             return tag, value
-        refs = split_ids(value)
-        refs = [self._index.get(ref, ref) for ref in refs]
-        return tag, ' ; '.join(refs)
+        return tag, self.rewrite(value)
 
     def __call__(self, entry):
         """Swap references to old IDs out for references to new IDs.
@@ -720,18 +817,22 @@ class LinkProcessor:
     This creates markdown-style links (like ``[human-readable label](ID)``).
     """
 
-    def __init__(self, id_index, label_index, link_markers, link_regex):
+    def __init__(self, id_index, label_index, link_markers, link_regex, matcher=None):
         """Create link processor.
 
         :arg id_index: dictionary ``old entry id`` -> ``new entry id``
         :arg label_index: dictionary ``new entry id`` -> ``human-readable label``
         :arg link_regex: regular expression for finding in-line cross
             references.
+        :arg matcher: object with a `sub` method like a compiled regular
+            expression (e.g. a `pydictionaria.headwords.HeadwordMatcher`),
+            which is used instead of `link_regex`.
         """
         self._ids = id_index
         self._labels = label_index
         self.markers = link_markers
         self.regex = link_regex
+        self._pattern = matcher if matcher is not None else re.compile(link_regex)
 
     def _replace_link(self, match):
         ref = match.group().strip()
@@ -740,9 +841,13 @@ class LinkProcessor:
         id_ = self._ids[ref]
         return f'[{self._labels.get(id_, id_)}]({id_})'
 
+    def rewrite(self, value):
+        """Replace the in-line references in a marker value with markdown-style links."""
+        return self._pattern.sub(self._replace_link, value)
+
     def _process_tag(self, tag, value):
         if tag in self.markers:
-            return tag, re.sub(self.regex, self._replace_link, value)
+            return tag, self.rewrite(value)
         else:
             return tag, value
 
@@ -758,6 +863,45 @@ class LinkProcessor:
         return new_entry
 
 
+class ReferenceRewriter:
+    """Visitor, which fixes cross references and in-line links in one go.
+
+    This combines `CrossRefs` and `LinkProcessor` (in this order), but rather
+    than building a copy of each entry, the values of the markers, which may
+    contain references, are replaced in place.
+    """
+
+    def __init__(self, *processors):
+        """Create reference rewriter.
+
+        :arg processors: `CrossRefs` or `LinkProcessor` instances; `None` is
+            ignored.
+        """
+        self._rewriters = defaultdict(list)
+        for processor in processors:
+            if processor is not None:
+                for marker in processor.markers:
+                    self._rewriters[marker].append(processor.rewrite)
+        self._rewriters = dict(self._rewriters)
+
+    def __call__(self, entry):
+        """Swap references to old IDs out for references to new IDs.
+
+        :returns: `entry`
+
+        .. warning:: `entry` is mutated in-place.
+        """
+        rewriters = self._rewriters
+        for i, (tag, value) in enumerate(entry):
+            if tag in rewriters:
+                new_value = value
+                for rewrite in rewriters[tag]:
+                    new_value = rewrite(new_value)
+                if new_value != value:
+                    entry[i] = (tag, new_value)
+        return entry
+
+
 def make_label_index(link_display_label, entries):
     """Map entry IDs to human-readable labels.
 
@@ -770,30 +914,141 @@ def make_label_index(link_display_label, entries):
 
 
 def make_link_processor(properties, id_index, entries):
-    """Factory function for `LinkProcessor`'s."""
-    link_markers = properties['process_links_in_markers']
-    link_regex = properties.get('link_regex')
+    """Factory function for `LinkProcessor`'s.
+
+    With the ``link_mode`` property set to ``headwords``, links are found by
+    looking for all known entry IDs (see `make_id_index`) instead of matching
+    ``link_regex``.
+    """
+    plan = ConversionPlan.from_properties(properties)
+    link_markers = plan.link_markers
+    link_regex = plan.properties.get('link_regex')
+    link_mode = plan.properties.get('link_mode') or 'regex'
 
     if not link_markers:
         return None
-    if link_regex is None:
+    if link_mode not in ('regex', 'headwords'):
+        raise ValueError(f'Unknown link_mode: {link_mode}')
+    if link_mode == 'regex' and link_regex is None:
         raise ValueError('Missing property: link_regex')
 
-    link_labels = make_label_index(properties['link_label_marker'], entries)
-    return LinkProcessor(id_index, link_labels, link_markers, link_regex)
+    link_labels = make_label_index(plan.link_label_marker, entries)
+    matcher = HeadwordMatcher(id_index) if link_mode == 'headwords' else None
+    return LinkProcessor(id_index, link_labels, link_markers, link_regex, matcher=matcher)
+
+
+_MULTIPLE_SPACES = re.compile(' +')
 
 
 def _single_spaces(s):
     s = s.strip().replace('\n', ' ')
-    s = re.sub(' +', ' ', s)
+    if '  ' in s:
+        s = _MULTIPLE_SPACES.sub(' ', s)
     return s
 
 
+def _split_ids(s):
+    return [eid.strip() for eid in s.split(';') if eid.strip()]
+
+
+_MISSING = object()
+
+
+class RowBuilder:
+    """Converter of SFM entries into the rows of a CLDF table.
+
+    The marker mapping is turned into a plan once, so that converting an entry
+    only takes one lookup per marker.
+    """
+
+    #: Pairs (entry attribute, CLDF column name) of attributes copied into rows.
+    attribute_columns = (
+        ('id', 'ID'),
+        ('entry_id', 'Entry_ID'),
+        ('sense_ids', 'Sense_IDs'),
+        ('media_ids', 'Media_IDs'))
+
+    def __init__(
+        self, table_name, mapping, source_refs, cross_ref_columns, language_id=None,
+    ):
+        """Create a row builder.
+
+        :arg table_name: Name of the CLDF table/component.
+        :arg mapping: dictionary ``SFM marker`` -> ``CLDF column name``
+        :arg source_refs: markers, which contain a row's ``Source``
+        :arg cross_ref_columns: CLDF column names, which denote cross references.
+        :arg language_id: value for the ``Language_ID`` column
+        """
+        self.table_name = table_name
+        self.language_id = language_id
+
+        # Plan: ``SFM marker`` -> (``CLDF column name``, source label)
+        self._plan = {
+            marker: (mapping.get(marker), source_refs.get(marker))
+            for marker in chain(mapping, source_refs)}
+
+        # The `csvw` package expects lists as input for fields with separators
+        self._splitters = dict.fromkeys(cross_ref_columns, _split_ids)
+        if table_name == 'ExampleTable':
+            self._splitters['Gloss'] = str.split
+            self._splitters['Analyzed_Word'] = str.split
+
+    def __call__(self, entry):
+        """Convert SFM entry into a CLDF row.
+
+        :returns: dictionary ``CLDF column name`` -> ``value``
+        """
+        # XXX(johannes): What if the same tag appears multiple times?
+        #  * Option 1: Overwrite old value for tag
+        #  * Option 2: Ignore new value if tag is already there
+        #  * Option 3: Collect values into semicolon-separated list (happening now)
+        plan = self._plan
+        values = {}
+        sources = []
+        for tag, value in entry:
+            step = plan.get(tag)
+            if step is None:
+                continue
+            column, source_label = step
+            if source_label:
+                sources.extend(
+                    f'{s.strip()}[{source_label}]'
+                    for s in value.split(';'))
+            if column and value:
+                if column in values:
+                    values[column].append(_single_spaces(value))
+                else:
+                    values[column] = [_single_spaces(value)]
+
+        row = {}
+        splitters = self._splitters
+        for column, parts in values.items():
+            value = parts[0] if len(parts) == 1 else DEFAULT_SEPARATOR.join(parts)
+            split = splitters.get(column)
+            row[column] = split(value) if split else value
+
+        for attribute, column in self.attribute_columns:
+            value = getattr(entry, attribute, _MISSING)
+            if value is not _MISSING:
+                row[column] = value
+        if self.language_id:
+            row['Language_ID'] = self.language_id
+
+        if sources:
+            row['Source'] = sources
+        elif row.get('Source') and isinstance(row['Source'], str):
+            row['Source'] = _split_ids(row['Source'])
+
+        return row
+
+
 def sfm_entry_to_cldf_row(
     table_name, mapping, source_refs, cross_ref_columns, entry, language_id=None,
 ):
     """Convert SFM entry into a CLDF row.
 
+    To convert many entries, use a `RowBuilder` instead.
+
     :arg table_name: Name of the CLDF table/component.
     :arg mapping: dictionary ``SFM marker`` -> ``CLDF column name``
     :arg source_refs: markers, which contain a row's ``Source``
@@ -803,49 +1058,9 @@ def sfm_entry_to_cldf_row(
 
     :returns: dictionary ``CLDF column name`` -> ``value``
     """
-    # XXX(johannes): What if the same tag appears multiple times?
-    #  * Option 1: Overwrite old value for tag
-    #  * Option 2: Ignore new value if tag is already there
-    #  * Option 3: Collect values into semicolon-separated list (happening now)
-    row = defaultdict(list)
-    sources = []
-    for tag, value in entry:
-        if tag in source_refs:
-            sources.extend(
-                f'{s.strip()}[{source_refs[tag]}]'
-                for s in value.split(';'))
-        key = mapping.get(tag)
-        if key and value:
-            row[key].append(_single_spaces(value))
-    row = {k: DEFAULT_SEPARATOR.join(v) for k, v in row.items()}
-    if hasattr(entry, 'id'):
-        row['ID'] = entry.id
-    if hasattr(entry, 'entry_id'):
-        row['Entry_ID'] = entry.entry_id
-    if hasattr(entry, 'sense_ids'):
-        row['Sense_IDs'] = entry.sense_ids
-    if hasattr(entry, 'media_ids'):
-        row['Media_IDs'] = entry.media_ids
-    if language_id:
-        row['Language_ID'] = language_id
-
-    if sources:
-        row['Source'] = sources
-
-    # The `csvw` package expects lists as input for fields with separators
-    if table_name == 'ExampleTable':
-        if 'Gloss' in row:
-            row['Gloss'] = row['Gloss'].split()
-        if 'Analyzed_Word' in row:
-            row['Analyzed_Word'] = row['Analyzed_Word'].split()
-    for col in cross_ref_columns:
-        if col in row:
-            row[col] = [eid.strip() for eid in row[col].split(';') if eid.strip()]
-
-    if row.get('Source') and isinstance(row.get('Source'), str):
-        row['Source'] = [src.strip() for src in row['Source'].split(';') if src.strip()]
-
-    return row
+    builder = RowBuilder(
+        table_name, mapping, source_refs, cross_ref_columns, language_id)
+    return builder(entry)
 
 
 def _amend_columns(cldf, table_name, entry_cols, crossrefs):
@@ -889,17 +1104,21 @@ def _amend_columns(cldf, table_name, entry_cols, crossrefs):
             cldf.add_foreign_key(table_name, colname, 'SenseTable', 'ID')
 
 
+def _used_columns(rows):
+    return sorted({col for row in rows for col, val in row.items() if val})
+
+
 def make_cldf_schema(cldf, properties, entries, senses, examples, media):
     """Add Dictionaria's tables and columns to a CLDF dataset.
 
     :arg cldf: CLDF dataset
-    :arg properties: ``md.json`` properties
+    :arg properties: ``md.json`` properties (or a `ConversionPlan`)
     :arg entries: collection of CLDF rows for the entries
     :arg senses: collection of CLDF rows for the senses
     :arg examples: collection of CLDF rows for the examples
     :arg media: collection of CLDF rows for media files
     """
-    properties = _add_property_fallbacks(properties)
+    plan = ConversionPlan.from_properties(properties)
 
     if not cldf.get('ExampleTable'):
         cldf.add_component('ExampleTable')
@@ -911,28 +1130,9 @@ def make_cldf_schema(cldf, properties, entries, senses, examples, media):
     if not cldf.get('LanguageTable'):
         cldf.add_component('LanguageTable')
 
-    crossref_markers = _get_crossref_markers(properties)
-
-    _amend_columns(
-        cldf,
-        'EntryTable',
-        sorted({col for row in entries for col, val in row.items() if val}),
-        {c for m, c in properties['entry_map'].items() if m in crossref_markers})
-    _amend_columns(
-        cldf,
-        'SenseTable',
-        sorted({col for row in senses for col, val in row.items() if val}),
-        {c for m, c in properties['sense_map'].items() if m in crossref_markers})
-    _amend_columns(
-        cldf,
-        'ExampleTable',
-        sorted({col for row in examples for col, val in row.items() if val}),
-        {c for m, c in properties['example_map'].items() if m in crossref_markers})
-    _amend_columns(
-        cldf,
-        'MediaTable',
-        sorted({col for row in media for col, val in row.items() if val}),
-        ())
+    for table, rows in zip(plan.tables, (entries, senses, examples)):
+        _amend_columns(cldf, table.name, _used_columns(rows), table.crossref_columns)
+    _amend_columns(cldf, 'MediaTable', _used_columns(media), ())
 
 
 def add_gloss_columns(cldf, glosses):
@@ -967,12 +1167,9 @@ def _add_labels_to_table(table, mapping, labels):
 
 def attach_column_titles(cldf, properties):
     """Add custom column titles to CLDF dataset."""
-    properties = _add_property_fallbacks(properties)
-
-    labels = properties['labels']
-    _add_labels_to_table(cldf['EntryTable'], properties['entry_map'], labels)
-    _add_labels_to_table(cldf['SenseTable'], properties['sense_map'], labels)
-    _add_labels_to_table(cldf['ExampleTable'], properties['example_map'], labels)
+    plan = ConversionPlan.from_properties(properties)
+    for table in plan.tables:
+        _add_labels_to_table(cldf[table.name], table.mapping, plan.labels)
 
 
 def _ensure_required_columns(cldf, table_name, rows, log):
@@ -1043,7 +1240,7 @@ def merge_gloss_into_example(glosses, example_row):
     :arg example_row: CLDF example.
     """
     if example_row['ID'] in glosses:
-        return ChainMap(glosses[example_row['ID']]['example'], example_row)
+        return {**example_row, **glosses[example_row['ID']]['example']}
     return example_row
 
 
@@ -1077,7 +1274,7 @@ def extract_concepticon_id(sense_row):
     comp_meaning = sense_row.get('Comparison_Meaning') or ''
     match = re.fullmatch(r'\w+ \[(\d+)\]', comp_meaning)
     if match:
-        return ChainMap(sense_row, {'Concepticon_ID': match.group(1)})
+        return {'Concepticon_ID': match.group(1), **sense_row}
     else:
         return sense_row
 
@@ -1085,7 +1282,7 @@ def extract_concepticon_id(sense_row):
 def add_media_metadata(media_catalog, media_row):
     """Add metadata to media file.
 
-    :arg media_catalog: CDstar catalog.
+    :arg media_catalog: CDstar catalog (or a `pydictionaria.sfm_lib.MediaResolver`).
     :arg media_row: Media item.
     """
     if media_row.get('ID') in media_catalog:
@@ -1096,11 +1293,83 @@ def add_media_metadata(media_catalog, media_row):
             'Media_Type': media_catalog[media_row['ID']]['mimetype'],
             'size': media_catalog[media_row['ID']]['size'],
         }
-        return ChainMap(media_row, metadata)
+        return {**media_row, **metadata}
     else:
         return media_row
 
 
+def _cell_formatter(column):
+    # Equivalent to `csvw.Column.write`, but with the properties of the column
+    # looked up once rather than for every cell.
+    separator = column.inherit('separator')
+    null = column.inherit_null()[0]
+    datatype = column.inherit('datatype')
+
+    if not datatype:
+        def format_value(v):
+            return null if v is None else v
+    elif datatype.base == 'string':
+        def format_value(v):
+            if v is None:
+                return null
+            return v if type(v) is str else f'{v}'
+    else:
+        to_string = partial(datatype.basetype.to_string, **datatype.derived_description)
+
+        def format_value(v):
+            return null if v is None else to_string(v)
+
+    if separator:
+        return lambda v: separator.join([format_value(vv) for vv in v or []])
+    return format_value
+
+
+def write_table(cldf, table_name, rows, zipped=False):
+    """Write CLDF rows to the CSV file of a table.
+
+    This does what `pycldf.Dataset.write` does for a single table, only
+    faster, so the rows can be written as soon as the schema is complete,
+    instead of being passed to ``args.writer.objects``.
+
+    :arg cldf: CLDF dataset
+    :arg table_name: CLDF table name
+    :arg rows: iterable of CLDF rows
+    :arg zipped: Whether the CSV file should be zipped.
+
+    :returns: the number of rows written.
+    """
+    table = cldf[table_name]
+    columns = [col for col in table.tableSchema.columns if not col.virtual]
+    # Like csvw, values are looked up by the header of a column and then by
+    # its name (which is only done if the two differ).
+    cells = [
+        (col.header, None if f'{col}' == col.header else f'{col}', _cell_formatter(col))
+        for col in columns]
+    dialect = table.dialect or cldf.tablegroup.dialect or Dialect()
+    path = table.url.resolve(cldf.directory)
+
+    row_count = 0
+    with UnicodeWriter(path, dialect=dialect) as writer:
+        if dialect.header:
+            writer.writerow([col.header for col in columns])
+        for row in rows:
+            writer.writerow([
+                format_cell(row.get(header) if name is None else row.get(header, row.get(name)))
+                for header, name, format_cell in cells])
+            row_count += 1
+
+    if zipped:
+        path = pathlib.Path(path)
+        with zipfile.ZipFile(
+            str(path.parent / f'{path.name}.zip'), 'w', compression=zipfile.ZIP_DEFLATED,
+        ) as zip_file:
+            zip_file.write(str(path), arcname=path.name)
+        path.unlink()
+
+    table.common_props['dc:extent'] = row_count
+    return row_count
+
+
 class LogOnlyBaseNames(logging.LoggerAdapter):
 
     def process(self, msg, kwargs):
@@ -1140,17 +1409,39 @@ def _source_mapping(sources, column_map):
         if t in column_map}
 
 
+# Version of the format of cached conversions; must be increased whenever the
+# rows produced by `process_dataset` change.
+CONVERSION_CACHE_VERSION = 1
+
+
+def conversion_cache_key(*paths):
+    """Compute the cache key for the result of a conversion.
+
+    The key is made up of the md5 sums of the files the conversion reads, so
+    a cached result stays valid as long as none of these files change.
+
+    :arg paths: paths of the input files (files that do not exist are allowed)
+
+    :returns: key for `pydictionaria.util.read_cache`.
+    """
+    key = [CONVERSION_CACHE_VERSION, __version__]
+    for path in map(pathlib.Path, paths):
+        key.append((path.name, md5(path) if path.exists() else None))
+    return key
+
+
 def process_dataset(
     sid, language_id, properties,
     sfm, examples, media_catalog,
     glosses_path, examples_log_path, glosses_log_path,
-    cldf_log,
+    cldf_log, workers=None, cache_dir=None,
 ):
     """Turn an SFM database into CLDF data.
 
     :arg sid: submission id
     :arg language_id: ID of the dictionary language
-    :arg properties: properties from the ``md.json`` metadata file
+    :arg properties: properties from the ``md.json`` metadata file (or a
+      `ConversionPlan`)
     :arg sfm: SFM database (see `pydictionaria.sfm_lib.Database`)
     :arg examples: SFM examples (see `pydictionaria.sfm_lib.Database`)
     :arg media_catalog: CDSTAR media catalog.
@@ -1160,47 +1451,66 @@ def process_dataset(
     :arg glosses_log_path: Path where error regarding gloss extraction are
       logged.
     :arg cldf_log: Logger object
-
-    :returns: a tuple containing:
-      * a list of EntryTable rows
-      * a list of SenseTable rows
-      * a list of ExampleTable rows
-      * a list of MediaTable rows
+    :arg workers: Number of processes to run the entry-local preprocessing
+      steps (see `pydictionaria.sfm_lib.Database.visit`) and the gloss
+      extraction in.  ID generation, example extraction and logging always
+      happen in the main process, so the output does not depend on the number
+      of workers.
+    :arg cache_dir: Directory to cache parsed SFM files (see
+      `pydictionaria.sfm_reader.read_into`), extracted glosses, checksums of
+      media files and the index of media file names in.
+
+    :returns: a tuple containing lists of
+      * EntryTable rows
+      * SenseTable rows
+      * ExampleTable rows
+      * MediaTable rows
     """
-    properties = _add_property_fallbacks(properties)
+    plan = ConversionPlan.from_properties(properties)
 
-    # Run generic normalization of sFM:
-    sfm.visit(normalize)
-    sfm.visit(Rearrange())
+    # Note: The per-entry steps are combined into `VisitorChain`s, so that the
+    # database is only traversed once for each stage of the conversion.  Only
+    # steps, which need to see *all* entries first (e.g. pruning examples or
+    # building the ID index), separate one stage from the next.
 
-    # Replace media references with md5 sums of referenced files:
-    media_sids = properties.get('media_lookup') or sid
+    # Run generic normalization of SFM and replace media references with md5
+    # sums of referenced files:
+    media_sids = plan.properties.get('media_lookup') or sid
     if not isinstance(media_sids, list):
         media_sids = [media_sids]
-    files = Files(media_catalog, media_sids)
-    sfm.visit(files)
-
-    caption_marker = properties.get('media_caption_marker')
+    checksums = ChecksumCache(
+        os.path.join(cache_dir, 'checksums.marshal') if cache_dir else None)
+    media = MediaResolver(media_catalog, media_sids, cache_dir=cache_dir)
+    files = Files(resolver=media, checksums=checksums)
+    preprocessors = [normalize, Rearrange(), files]
+    parallel = {'workers': workers} if workers else {}
+
+    caption_marker = plan.properties.get('media_caption_marker')
     caption_finder = CaptionFinder(
         ['pc', 'sf', 'sfx'], caption_marker)
     if caption_marker:
-        sfm.visit(caption_finder)
+        preprocessors.append(caption_finder)
 
     # Process FLEx's cross-references in \lf markers
-    flexref_map = properties['flexref_map']
-    sfm.visit(partial(preprocess_flex_crossrefs, flexref_map))
+    preprocessors.append(partial(preprocess_flex_crossrefs, plan.flexref_map))
 
     if not examples:
         with open(examples_log_path, 'w', encoding='utf8') as example_log:
             # FIXME(johannes): This should go into make_spec
-            example_markers = set(properties['example_map'])
+            example_markers = set(plan.example_table.mapping)
             example_markers.add('sfx')
-            if 'gloss_ref' in properties:
-                example_markers.add(properties['gloss_ref'])
+            if plan.gloss_ref is not None:
+                example_markers.add(plan.gloss_ref)
             # FIXME(johannes): I don't think `Corpus` is used anywhere to begin with...
             extractor = ExampleExtractor(
-                example_markers, Corpus.from_dir(examples_log_path.parent), example_log)
-            sfm.visit(extractor)
+                example_markers,
+                Corpus.from_dir(examples_log_path.parent, cache_dir=cache_dir),
+                example_log)
+            if parallel:
+                sfm.visit(VisitorChain(*preprocessors), **parallel)
+                sfm.visit(extractor)
+            else:
+                sfm.visit(VisitorChain(*preprocessors, extractor))
             examples = Examples(extractor.examples.values())
             for dups in find_duplicate_examples('tx', examples):
                 print('# potential duplicate w.r.t. \\xe', file=example_log)
@@ -1210,12 +1520,19 @@ def process_dataset(
                 print('# potential duplicate w.r.t. \\xv', file=example_log)
                 print('\n# and\n'.join(map(str, dups)), file=example_log)
                 print(file=example_log)
+    else:
+        sfm.visit(VisitorChain(*preprocessors), **parallel)
+    checksums.save()
+
+    all_markers = set()
+    cited = set()
+    for entry in sfm:
+        for marker, content in entry:
+            all_markers.add(marker)
+            if marker == 'xref':
+                cited.add(content)
 
     original_amount = len(examples)
-    cited = {
-        xref
-        for example in sfm
-        for xref in example.getall('xref')}
     examples = Examples(
         example
         for example in examples
@@ -1223,11 +1540,11 @@ def process_dataset(
     if original_amount - len(examples):
         print('pruning', original_amount - len(examples), 'examples from', original_amount)
 
-    all_markers = {
+    all_markers.update(
         marker
-        for entry in chain(sfm, examples)
-        for marker, _ in entry}
-    spec = make_spec(properties, all_markers)
+        for example in examples
+        for marker, _ in example)
+    spec = make_spec(plan, all_markers)
 
     all_markers -= spec['entry_markers']
     all_markers -= spec['sense_markers']
@@ -1246,132 +1563,102 @@ def process_dataset(
         gloss_logname = f'{sid}.glosses'
         with open(glosses_log_path, 'w', encoding='utf-8') as gloss_logfile:
             gloss_log = make_log(gloss_logname, gloss_logfile)
-            gloss_ref_marker = properties.get('gloss_ref')
+            gloss_ref_marker = plan.gloss_ref
             if gloss_ref_marker:
                 glosses = prepare_glosses(
-                    glosses_path, gloss_ref_marker, examples, gloss_log)
+                    glosses_path, gloss_ref_marker, examples, gloss_log,
+                    cache_dir=cache_dir, **parallel)
             else:
                 gloss_log.error("no 'gloss_ref' marker specified")
             check_for_missing_glosses(
                 gloss_ref_marker, glosses, examples, gloss_log)
 
-    sfm.visit(lambda e: validate_ps(e, cldf_log))
-    sfm.visit(merge_pos)
+    sfm.visit(VisitorChain(partial(validate_ps, log=cldf_log), merge_pos))
 
-    crossref_markers = _get_crossref_markers(properties)
+    crossref_markers = plan.crossref_markers
 
     entry_extr = EntryExtractor(
-        properties['entry_id'],
+        plan.entry_id,
         spec['entry_markers'])
     sense_extr = SenseExtractor(
-        properties['sense_sep'],
+        plan.sense_sep,
         spec['sense_markers'],
         crossref_markers,
         cldf_log)
 
-    rest = [entry_extr(entry) for entry in sfm]
-    rest = [sense_extr(entry) for entry in rest if entry]
+    for entry in sfm:
+        rest = entry_extr(entry)
+        if rest:
+            sense_extr(rest)
 
     entries = entry_extr.entries
     senses = sense_extr.senses
 
+    media_extr = MediaExtractor('sf', media)
+
+    id_index = make_id_index(entries)
+    crossref_processor = CrossRefs(id_index, crossref_markers)
+
+    link_error = None
+    try:
+        link_processor = make_link_processor(
+            plan, id_index, entries)
+    except ValueError as e:
+        link_processor = None
+        link_error = e
+
     ex_ref = ExampleReferencer(example_index)
-    senses.visit(ex_ref)
+
+    references = ReferenceRewriter(crossref_processor, link_processor)
+    entries.visit(VisitorChain(media_extr, references))
+    media_extr.tag = 'pc'
+    senses.visit(VisitorChain(ex_ref, media_extr, references))
+    media_extr.tag = 'sfx'
+    examples.visit(VisitorChain(media_extr, references))
 
     if ex_ref.invalid_example_ids:
         example_list = ', '.join(
             sorted(map(repr, ex_ref.invalid_example_ids)))
         cldf_log.warning('senses refer to non-existent examples: %s', example_list)
 
-    media_sids = properties.get('media_lookup') or sid
-    if not isinstance(media_sids, list):
-        media_sids = [media_sids]
-
-    media_id_index = {
-        entry['fname']: checksum
-        for checksum, entry in media_catalog.items()
-        if entry['sid'] in media_sids}
-    for fname in list(media_id_index.keys()):
-        media_id_index[fname.split('.')[0]] = media_id_index[fname]
-    media_extr = MediaExtractor(
-        'sf',
-        media_id_index,
-        media_catalog)
-
-    entries.visit(media_extr)
-    media_extr.tag = 'pc'
-    senses.visit(media_extr)
-    media_extr.tag = 'sfx'
-    examples.visit(media_extr)
+    media.report(cldf_log)
 
-    if media_extr.orphans:
-        file_list = ', '.join(sorted(map(repr, media_extr.orphans)))
-        cldf_log.warning('unknown media files: %s', file_list)
+    if link_error is not None:
+        cldf_log.warning('could not process links: %s', str(link_error))
 
-    id_index = make_id_index(entries)
-
-    crossref_processor = CrossRefs(id_index, crossref_markers)
-    entries.visit(crossref_processor)
-    senses.visit(crossref_processor)
-    examples.visit(crossref_processor)
+    entry_builder = RowBuilder(
+        'EntryTable',
+        plan.entry_table.mapping,
+        plan.entry_table.source_refs,
+        plan.entry_table.crossref_columns,
+        language_id)
+    sense_builder = RowBuilder(
+        'SenseTable',
+        plan.sense_table.mapping,
+        plan.sense_table.source_refs,
+        plan.sense_table.crossref_columns)
+    example_builder = RowBuilder(
+        'ExampleTable',
+        plan.example_table.mapping,
+        plan.example_table.source_refs,
+        plan.example_table.crossref_columns,
+        language_id)
+
+    entry_rows = [entry_builder(entry) for entry in entries]
+    sense_rows = [extract_concepticon_id(sense_builder(sense)) for sense in senses]
+    example_rows = [example_builder(example) for example in examples]
+    if glosses:
+        example_rows = [
+            merge_gloss_into_example(glosses, row)
+            for row in example_rows]
 
-    try:
-        link_processor = make_link_processor(
-            properties, id_index, entries)
-        if link_processor is not None:
-            entries.visit(link_processor)
-            senses.visit(link_processor)
-            examples.visit(link_processor)
-    except ValueError as e:
-        cldf_log.warning('could not process links: %s', str(e))
-
-    # XXX(johannes): can I get rid of these lines?
-    entry_crossref_cols = {c for m, c in properties['entry_map'].items() if m in crossref_markers}
-    sense_crossref_cols = {c for m, c in properties['sense_map'].items() if m in crossref_markers}
-    example_crossref_cols = {
-        c for m, c in properties['example_map'].items() if m in crossref_markers}
-
-    entry_rows = [
-        sfm_entry_to_cldf_row(
-            'EntryTable',
-            properties['entry_map'],
-            _source_mapping(properties['sources'], properties['entry_map']),
-            entry_crossref_cols,
-            entry,
-            language_id)
-        for entry in entries]
-    sense_rows = [
-        sfm_entry_to_cldf_row(
-            'SenseTable',
-            properties['sense_map'],
-            _source_mapping(properties['sources'], properties['sense_map']),
-            sense_crossref_cols,
-            sense)
-        for sense in senses]
-    example_rows = [
-        sfm_entry_to_cldf_row(
-            'ExampleTable',
-            properties['example_map'],
-            _source_mapping(properties['sources'], properties['example_map']),
-            example_crossref_cols,
-            example,
-            language_id)
-        for example in examples]
     media_rows = [
-        {
+        add_media_metadata(media, {
             'ID': fileid,
             'Language_ID': language_id,
             'Name': filename,
             'Description': caption_finder.captions.get(fileid),
-        }
+        })
         for filename, fileid in sorted(media_extr.files)]
 
-    sense_rows = list(map(extract_concepticon_id, sense_rows))
-    media_rows = [add_media_metadata(media_catalog, row) for row in media_rows]
-
-    if glosses:
-        example_rows = [
-            merge_gloss_into_example(glosses, row)
-            for row in example_rows]
-
     return entry_rows, sense_rows, example_rows, media_rows
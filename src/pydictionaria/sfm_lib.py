@@ -1,4 +1,8 @@
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import hashlib
+import marshal
 import re
 import copy
 import unicodedata
@@ -6,12 +10,15 @@ from unidecode import unidecode_expect_ascii
 
 from transliterate import translit
 from clldutils.sfm import FIELD_SPLITTER_PATTERN, SFM
-from clldutils.sfm import Entry as BaseEntry
-from clldutils.path import md5, Path
+from clldutils.path import Path
 from clldutils.misc import slug
 from clldutils.text import split_text
 
-from pydictionaria.util import split_ids
+from pydictionaria.concepticon_index import concepticon_version
+from pydictionaria.sfm_reader import read_into
+from pydictionaria.util import (
+    ChecksumCache, IndexedEntry, read_cache, split_ids, write_cache,
+)
 from pydictionaria.example import Example, concat_multilines
 
 
@@ -27,19 +34,15 @@ def fsname(n):
     return unicodedata.normalize('NFC', n)
 
 
-class Entry(BaseEntry):
+class Entry(IndexedEntry):
     @property
     def id(self):
         return '{} {}'.format(self.get('lx') or '', self.get('hm') or '').strip()
 
     def upsert(self, marker, content, index=-1):
-        for i, (k, _) in enumerate(self):  # noqa: B007
-            if k == marker:
-                break
-        else:
-            i = None
-        if i is not None:
-            self[i] = (marker, content)
+        positions = self.positions(marker)
+        if positions:
+            self[positions[0]] = (marker, content)
         else:
             self.insert(index, (marker, content))
 
@@ -50,10 +53,29 @@ class Database(SFM):
         kw.setdefault('entry_sep', '\\lx ')
         self.read(fname, entry_impl=Entry, **kw)
 
-    def visit(self, visitor):
+    def read(self, filename, **kw):
+        """
+        Extend the database by entries read from an SFM file.
+
+        See `pydictionaria.sfm_reader.read_into` for the keyword arguments, e.g. `cache_dir`.
+        """
+        read_into(self, filename, **kw)
+
+    def visit(self, visitor, workers=None):
+        """
+        Run `visitor` on each entry, removing entries for which it returns `False`.
+
+        :param workers: If greater than 1, the entries are split into chunks, which are \
+        processed by a pool of `workers` processes.  The visitor must be picklable and the \
+        results are merged in the original order.  State the visitor accumulates in the \
+        worker processes is handed back to its `merge` method, if it has one.
+        """
+        if workers and workers > 1 and len(self) > 1:
+            results = _visit_in_parallel(visitor, self, workers)
+        else:
+            results = map(visitor, self)
         remove = []
-        for i, entry in enumerate(self):
-            res = visitor(entry)
+        for i, (entry, res) in enumerate(zip(self, results)):
             if res is False:
                 remove.append(i)
             else:
@@ -62,13 +84,85 @@ class Database(SFM):
             del self[i]
 
 
+def _visit_chunk(visitor, entries):
+    return [visitor(entry) for entry in entries], visitor
+
+
+def _visit_in_parallel(visitor, entries, workers):
+    chunk_size = -(-len(entries) // (workers * 4))
+    chunks = [
+        entries[i:i + chunk_size]
+        for i in range(0, len(entries), chunk_size)]
+    merge = getattr(visitor, 'merge', None)
+    results = []
+    with ProcessPoolExecutor(workers) as pool:
+        for chunk_results, chunk_visitor in pool.map(partial(_visit_chunk, visitor), chunks):
+            results.extend(chunk_results)
+            if merge:
+                merge(chunk_visitor)
+    return results
+
+
+class VisitorChain:
+    """
+    SFM visitor, running several visitors on an entry one after the other.
+
+    This allows to apply a whole sequence of visitors in a single traversal of a
+    database.  Each visitor gets the result of the previous one.  As with
+    `Database.visit`, a visitor may return `None` to keep the entry unchanged or
+    `False` to drop it, in which case the remaining visitors are skipped.
+
+    Visitors, which are `None`, are ignored, so that optional steps can be passed
+    in directly.
+    """
+    def __init__(self, *visitors):
+        self.visitors = [v for v in visitors if v is not None]
+
+    def __call__(self, entry):
+        for visitor in self.visitors:
+            res = visitor(entry)
+            if res is False:
+                return False
+            entry = res or entry
+        return entry
+
+    def merge(self, other):
+        """Merge state accumulated by a copy of this chain (see `Database.visit`)."""
+        for visitor, other_visitor in zip(self.visitors, other.visitors):
+            if hasattr(visitor, 'merge'):
+                visitor.merge(other_visitor)
+
+
 class ComparisonMeanings:
-    def __init__(self, concepticon, marker='zcom2'):
+    """
+    SFM visitor, adding the Concepticon concept sets matching the comparison meanings of an
+    entry.
+
+    Lookups are memoized by the set of comparison meanings of an entry, since the same
+    meanings (e.g. "dog" or "to eat") recur across entries.  To look up the meanings of a
+    whole database at once, call `prepare` before visiting it:
+
+        comparison_meanings = ComparisonMeanings(concepticon, cache_dir=cache_dir)
+        comparison_meanings.prepare(db)
+        db.visit(comparison_meanings)
+
+    :param concepticon: `pyconcepticon.Concepticon` instance or \
+    `pydictionaria.concepticon_index.ConcepticonIndex`.
+    :param cache_dir: Directory to keep the results of the lookups in between runs (see \
+    `prepare`).  The cache is invalidated when the Concepticon data or the version of \
+    `pyconcepticon` change.
+    """
+    similarity_level = 9
+
+    def __init__(self, concepticon, marker='zcom2', cache_dir=None):
         self.concepticon = concepticon
         self.marker = marker
+        self.cache_dir = cache_dir
         self.dot_pattern = re.compile(r'(?P<pre>[a-zA-Z])\.(?P<post>[a-zA-Z])')
+        self._matches = {}
 
-    def __call__(self, entry):
+    def comparison_meanings(self, entry):
+        """Return the sorted tuple of (lower-cased) comparison meanings of an entry."""
         comps = set()
         for marker in ['de', 're']:
             for content in entry.getall(marker):
@@ -81,18 +175,66 @@ class ComparisonMeanings:
                         comp = comp.replace('.', ' ').strip()
                     if comp:
                         comps.add(comp.lower())
-        if comps:
-            comps = list(comps)
+        return tuple(sorted(comps))
+
+    def lookup(self, comps):
+        """
+        Look up comparison meanings in Concepticon.
+
+        Note: Concepticon matches each concept set to one meaning at most, so the meanings
+        of an entry are always looked up together.
+
+        :param comps: Sorted tuple of comparison meanings.
+        :return: Sorted tuple of IDs of matching concept sets.
+        """
+        try:
+            return self._matches[comps]
+        except KeyError:
             matches = set()
-            for matchset in self.concepticon.lookup(comps, similarity_level=9):
+            for matchset in self.concepticon.lookup(
+                list(comps), similarity_level=self.similarity_level
+            ):
                 for m in matchset:
                     matches.add(m[1])
+            res = self._matches[comps] = tuple(sorted(matches))
+            return res
+
+    def _cache(self):
+        version = concepticon_version(self.concepticon) if self.cache_dir else None
+        if not version:
+            return None
+        key = (version, self.similarity_level)
+        return Path(self.cache_dir) / 'concepticon-lookups.marshal', key
+
+    def prepare(self, entries):
+        """
+        Look up the comparison meanings of all `entries` in one go.
+
+        With a `cache_dir`, only meanings looked up in none of the previous runs are
+        looked up in Concepticon.
+        """
+        cache = self._cache()
+        if cache:
+            self._matches.update(read_cache(*cache, serializer=marshal) or {})
+        missing = {
+            comps
+            for entry in entries
+            if (comps := self.comparison_meanings(entry)) and comps not in self._matches}
+        for comps in sorted(missing):
+            self.lookup(comps)
+        if cache and missing:
+            write_cache(*cache, self._matches, serializer=marshal)
+
+    def __call__(self, entry):
+        comps = self.comparison_meanings(entry)
+        if comps:
+            matches = self.lookup(comps)
             if matches:
                 try:
                     matches = [
                         '{0.gloss} [{0.id}] "{0.definition}"'.format(
                             self.concepticon.conceptsets[m])
-                        for m in sorted(matches)]
+                        for m in matches]
                     entry.append((self.marker, ' ; '.join(matches)))
                 except KeyError:
                     print(matches)
@@ -111,33 +253,166 @@ def normalize(entry):
     return new
 
 
+# Version of the format of cached media indexes; must be increased whenever
+# `_media_index` changes.
+MEDIA_INDEX_VERSION = 2
+
+
+def _media_index(media_catalog, media_sids):
+    files = defaultdict(dict)
+    ids = {}
+    for checksum, spec in media_catalog.items():
+        # Register files already uploaded to CDStar:
+        if spec['sid'] in media_sids:
+            fname = Path(spec['fname'])
+            files[spec['type']][fsname(spec['fname'])] = checksum
+            files[spec['type']][fsname(fname.stem)] = checksum
+            files[spec['type']][fsname(fname.stem) + fname.suffix.upper()] = checksum
+            files[spec['type']][fsname(fname.stem) + fname.suffix.lower()] = checksum
+            # and just in case, add transliterated variants of file names:
+            nname = translit(spec['fname'], 'ru', reversed=True)
+            if nname not in files[spec['type']]:
+                files[spec['type']][nname] = checksum
+            ids[spec['fname']] = checksum
+    for fname in list(ids):
+        ids[fname.split('.')[0]] = ids[fname]
+    return files, ids
+
+
+def _cached_media_index(media_catalog, media_sids, cache_dir):
+    # Later catalog items may override the variants of earlier ones, so the
+    # revision of the catalog depends on the order of the items.
+    revision = hashlib.md5(marshal.dumps([
+        (checksum, spec['type'], spec['fname'])
+        for checksum, spec in media_catalog.items()
+        if spec['sid'] in media_sids])).hexdigest()
+    cache_path = Path(cache_dir) / 'media-files.marshal'
+    key = (MEDIA_INDEX_VERSION, revision)
+    index = read_cache(cache_path, key, serializer=marshal)
+    if index is None:
+        files, ids = _media_index(media_catalog, media_sids)
+        write_cache(cache_path, key, (dict(files), ids), serializer=marshal)
+        return files, ids
+    files, ids = index
+    return defaultdict(dict, files), ids
+
+
+@lru_cache(maxsize=2**16)
+def _media_file_name(ref):
+    """Strip the directory (with `/` or `\\` as separator) from a media reference."""
+    return fsname(ref.replace('\\', '/').rpartition('/')[2])
+
+
+class MediaResolver:
+    """
+    Index of the media files of a dictionary, resolving media references to CDSTAR items.
+
+    The resolver also acts as (read-only) mapping of checksums to the items in the catalog
+    and collects the references, which could not be resolved.
+
+    :param media_catalog: dictionary ``checksum`` -> ``media item`` (i.e. the content of \
+    `cdstar.json`).
+    :param media_sids: List of dictionary IDs, whose media files can be referenced.
+    :param cache_dir: Directory to cache the index of file names in.  The index is rebuilt \
+    when the relevant items of the catalog change.
+    """
+    def __init__(self, media_catalog, media_sids, cache_dir=None):
+        self.catalog = media_catalog
+        if cache_dir:
+            self.files, self.ids = _cached_media_index(media_catalog, media_sids, cache_dir)
+        else:
+            self.files, self.ids = _media_index(media_catalog, media_sids)
+        self.missing_files = set()
+        self.orphans = set()
+
+    def __contains__(self, checksum):
+        return checksum in self.catalog
+
+    def __getitem__(self, checksum):
+        return self.catalog[checksum]
+
+    def lookup(self, reference, mtypes):
+        """
+        Look up a file name (as normalised by `Files`) among the files of the given types.
+
+        File names match the name of a file, its stem, its name with upper- or lower-case
+        suffix, or a latin transliteration of a cyrillic name.
+
+        :return: The checksum of the file (or a `Path`, for files registered locally) or \
+        `None`.
+        """
+        for mtype in mtypes:
+            p = self.files[mtype].get(reference)
+            if p:
+                return p
+        return None
+
+    def resolve(self, value):
+        """
+        Resolve a media reference given either as checksum or as file name.
+
+        :return: pair (file name, file ID).  Unknown references are returned unchanged and \
+        recorded as `orphans`.
+        """
+        if value in self.catalog:
+            return self.catalog[value]['fname'], value
+        if value in self.ids:
+            return value, self.ids[value]
+        self.orphans.add(value)
+        return value, value
+
+    def merge(self, other):
+        """Add the unresolved references of a copy of the resolver."""
+        self.missing_files.update(other.missing_files)
+        self.orphans.update(other.orphans)
+
+    def report(self, log):
+        """Log the media references, which could not be resolved."""
+        if self.missing_files:
+            file_list = ', '.join(sorted({repr(fname) for _, _, fname in self.missing_files}))
+            log.warning('missing media files: %s', file_list)
+        if self.orphans:
+            file_list = ', '.join(sorted(map(repr, self.orphans)))
+            log.warning('unknown media files: %s', file_list)
+
+
 class Files:
     """
     SFM visitor, checking/editing media references
+
+    :param checksums: `pydictionaria.util.ChecksumCache` used to compute the md5 sums of \
+    registered files given as `Path`.
+    :param cache_dir: Directory to cache the index of file name variants of the media \
+    catalog in (see `MediaResolver`).
+    :param resolver: `MediaResolver` to use instead of building one from the catalog.
     """
-    def __init__(self, media_catalog, media_sids, mode='edit'):
+    def __init__(
+        self,
+        media_catalog=None,
+        media_sids=None,
+        mode='edit',
+        checksums=None,
+        cache_dir=None,
+        resolver=None,
+    ):
         self.mode = mode
+        self.checksums = checksums or ChecksumCache()
         self.file_sep = re.compile(',|;')
-        self.missing_files = set()
-        self.files = defaultdict(dict)
         self.marker_to_mtypes = {
             'pc': ['image'],
             'sf': ['audio'],
             'sfx': ['image', 'audio'],
         }
+        self.resolver = resolver or MediaResolver(
+            media_catalog or {}, media_sids or [], cache_dir=cache_dir)
 
-        for checksum, spec in media_catalog.items():
-            # Register files already uploaded to CDStar:
-            if spec['sid'] in media_sids:
-                fname = Path(spec['fname'])
-                self.files[spec['type']][fsname(spec['fname'])] = checksum
-                self.files[spec['type']][fsname(fname.stem)] = checksum
-                self.files[spec['type']][fsname(fname.stem) + fname.suffix.upper()] = checksum
-                self.files[spec['type']][fsname(fname.stem) + fname.suffix.lower()] = checksum
-                # and just in case, add transliterated variants of file names:
-                nname = translit(spec['fname'], 'ru', reversed=True)
-                if nname not in self.files[spec['type']]:
-                    self.files[spec['type']][nname] = checksum
+    @property
+    def files(self):
+        return self.resolver.files
+
+    @property
+    def missing_files(self):
+        return self.resolver.missing_files
 
     def __call__(self, entry):
         """
@@ -150,12 +425,10 @@ class Files:
             if mtypes:
                 normalized = []
                 for fname in split_ids(content, self.file_sep):
-                    fname = fsname(re.split(r'/|\\', fname)[-1])
-                    for mtype in mtypes:
-                        p = self.files[mtype].get(fname)
-                        if p:
-                            normalized.append(md5(p) if isinstance(p, Path) else p)
-                            break
+                    fname = _media_file_name(fname)
+                    p = self.resolver.lookup(fname, mtypes)
+                    if p:
+                        normalized.append(self.checksums.md5(p) if isinstance(p, Path) else p)
                     else:
                         self.missing_files.add((entry.id, marker, fname))
                 content = ' ; '.join(normalized)
@@ -165,6 +438,10 @@ class Files:
         else:
             return None
 
+    def merge(self, other):
+        self.resolver.merge(other.resolver)
+        self.checksums.merge(other.checksums)
+
 
 def move_marker(entry, m, before):
     reorder_map = []
@@ -326,6 +603,41 @@ class ExampleError(ValueError):
     pass
 
 
+# Markers, which must agree for two examples to be merged.
+MERGED_EXAMPLE_MARKERS = ['rf', 'tx', 'mb', 'gl', 'ft', 'ot']
+
+# Example texts and translations tend to be re-used a lot.
+_cached_slug = lru_cache(maxsize=2 ** 16)(slug)
+
+
+def _fingerprint(example):
+    """
+    Return the slugs of the values of an example, which must agree for examples to be merged.
+
+    Missing (or empty) values are represented by `None`.
+    """
+    return tuple(
+        _cached_slug(value) if (value := example.get(prop)) else None
+        for prop in MERGED_EXAMPLE_MARKERS)
+
+
+def _conflicting_marker(fingerprint1, fingerprint2):
+    """Return the first marker, in which two examples disagree, or `None`."""
+    for prop, slug1, slug2 in zip(MERGED_EXAMPLE_MARKERS, fingerprint1, fingerprint2):
+        if slug1 is not None and slug2 is not None and slug1 != slug2:
+            return prop
+    return None
+
+
+def _merge_error(prop, ex1, ex2):
+    return ExampleError(f'# cannot merge \\{prop}:\n{ex1}\n# and\n{ex2}\n\n')
+
+
+def _variant_id(example_id, count):
+    """Return the ID given to the `count`th distinct example with ID `example_id`."""
+    return f'{example_id}---{count}' if count else example_id
+
+
 class ExampleExtractor:
     """
     SFM visitor to extract examples
@@ -338,6 +650,17 @@ class ExampleExtractor:
         """
         self.example_markers = example_markers
         self.examples = {}
+        # Maps IDs of the extracted examples to their fingerprints.
+        self._fingerprints = {}
+        # Maps IDs to the number of examples known to be stored under the ID
+        # and its variants, i.e. `ID`, `ID---1`, `ID---2`, ...
+        self._variant_counts = {}
+        # Maps pairs (ID, fingerprint) to the number of the variant of the ID
+        # an example with the fingerprint was stored under.
+        self._variants = {}
+        # Maps IDs to the string representation of the examples, which is
+        # needed for each example they cannot be merged with.
+        self._strings = {}
         self.corpus = corpus
         self.log = log
 
@@ -350,42 +673,76 @@ class ExampleExtractor:
         return state_machine.entry
 
     def merge(self, ex1, ex2):
+        return self._merge(ex1, ex2, _fingerprint(ex1), _fingerprint(ex2))[0]
+
+    def _merge(self, ex1, ex2, fingerprint1, fingerprint2):
+        """
+        Merge two examples, given their fingerprints.
+
+        :return: A pair (merged example, fingerprint of the merged example).
+        """
+        prop = _conflicting_marker(fingerprint1, fingerprint2)
+        if prop:
+            raise _merge_error(prop, ex1, ex2)
         merged_ex = copy.copy(ex1)
-        for prop in ['rf', 'tx', 'mb', 'gl', 'ft', 'ot']:
-            p1 = merged_ex.get(prop)
-            p2 = ex2.get(prop)
-            if p1 and p2:
-                if slug(p1) != slug(p2):
-                    raise ExampleError(
-                        f'# cannot merge \\{prop}:\n{ex1}\n# and\n{ex2}\n\n')
-            elif p2:
-                merged_ex.set(prop, p2)
+        for prop, slug1, slug2 in zip(MERGED_EXAMPLE_MARKERS, fingerprint1, fingerprint2):
+            if slug1 is None and slug2 is not None:
+                merged_ex.set(prop, ex2.get(prop))
         merged_ex.set(
             'lemma',
             ' ; '.join(sorted(set(ex2.lemmas) - set(merged_ex.lemmas))))
-        return merged_ex
+        return merged_ex, tuple(
+            slug2 if slug1 is None else slug1
+            for slug1, slug2 in zip(fingerprint1, fingerprint2))
 
     def xref(self, example):
+        fingerprint = _fingerprint(example)
         if example.corpus_ref:
             from_corpus = self.corpus.get(example.corpus_ref)
             if from_corpus:
                 try:
-                    example = self.merge(example, from_corpus)
+                    example, fingerprint = self._merge(
+                        example, from_corpus, fingerprint, _fingerprint(from_corpus))
                 except ExampleError as err:
                     self.log.write(str(err))
 
+        # The example is merged into the first of the examples stored under
+        # `orig`, `orig---1`, ..., it agrees with, or stored under the next
+        # free variant of its ID.  Disagreeing examples stay disagreeing, when
+        # more examples are merged into them, so examples with the same
+        # fingerprint always end up in the same place.
         orig = example.id
-        count = 0
-        while example.id in self.examples:
-            try:
-                example = self.merge(self.examples[example.id], example)
-                break
-            except ExampleError as err:
-                self.log.write(str(err))
-                count += 1
-                example.set('ref', f'{orig}---{count}')
-
-        self.examples[example.id] = example
+        count = self._variant_counts.get(orig, 0)
+        while _variant_id(orig, count) in self.examples:
+            count += 1
+        self._variant_counts[orig] = count
+        variant = self._variants.get((orig, fingerprint))
+        if variant is None:
+            variant = next(
+                (i for i in range(count)
+                 if not _conflicting_marker(
+                     self._fingerprints[_variant_id(orig, i)], fingerprint)),
+                count)
+            self._variants[orig, fingerprint] = variant
+
+        for i in range(variant):
+            ex_id = _variant_id(orig, i)
+            if i:
+                example.set('ref', ex_id)
+            prop = _conflicting_marker(self._fingerprints[ex_id], fingerprint)
+            if ex_id not in self._strings:
+                self._strings[ex_id] = str(self.examples[ex_id])
+            self.log.write(str(_merge_error(prop, self._strings[ex_id], example)))
+
+        ex_id = _variant_id(orig, variant)
+        if variant:
+            example.set('ref', ex_id)
+        if variant < count:
+            example, fingerprint = self._merge(
+                self.examples[ex_id], example, self._fingerprints[ex_id], fingerprint)
+        self.examples[ex_id] = example
+        self._fingerprints[ex_id] = fingerprint
+        self._strings.pop(ex_id, None)
         return example.id
 
     def write_examples(self, fname):
@@ -393,7 +750,10 @@ class ExampleExtractor:
         examples.write(fname)
 
 
+@lru_cache(maxsize=2 ** 16)
 def _normalise_example_value(s):
+    # Note: Transliterating is slow and the same texts and translations occur
+    # in many examples.
     s = unidecode_expect_ascii(s)
     s = ''.join(c for c in s if c.isalnum())
     s = s.lower()
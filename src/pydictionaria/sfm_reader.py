@@ -0,0 +1,194 @@
+"""
+Fast reader for SFM files.
+
+The reader yields the same entries as `clldutils.sfm.SFM.read`, but rather than reading and
+splitting the whole file line by line, it memory-maps the file, looks for the entry separators
+in the raw bytes and only decodes and tokenises one entry at a time.
+"""
+import codecs
+from hashlib import md5
+import marshal
+import mmap
+import re
+
+from clldutils.path import Path
+from clldutils.sfm import Entry, SFM
+
+from pydictionaria.util import paused_gc, read_cache, write_cache
+
+# A line starting with a marker, i.e. a backslash followed by the marker name
+# and whitespace or the end of the line (cf. `clldutils.sfm.MARKER_PATTERN`).
+MARKER_LINE_PATTERN = re.compile(
+    r'^[^\S\n]*\\(?P<marker>[A-Za-z0-9][A-Za-z0-9_]*)(?=\s|$)(?P<value>.*)', re.MULTILINE)
+# The same, but only capturing the marker (for splitting a block into markers
+# and multi-line values).
+MARKER_SPLIT_PATTERN = re.compile(
+    r'^[^\S\n]*\\([A-Za-z0-9][A-Za-z0-9_]*)(?=\s|$)', re.MULTILINE)
+# A non-blank line, which neither starts with a marker nor is an SFM header
+# line, i.e. the continuation of a multi-line value.
+CONTINUATION_LINE_PATTERN = re.compile(
+    r'^[^\S\n]*(?:[^\\\s]|\\(?:[^A-Za-z0-9_]|$)|\\[A-Za-z0-9][A-Za-z0-9_]*[^A-Za-z0-9_\s])',
+    re.MULTILINE)
+
+# Encodings, in which an entry separator can be found by searching the raw
+# bytes of a file.
+BYTE_SEARCHABLE_ENCODINGS = {'utf-8', 'ascii', 'latin-1', 'iso8859-1', 'cp1252'}
+
+# Version of the format of cached entries; must be increased whenever the
+# parsing results change.
+CACHE_VERSION = 1
+
+
+def is_byte_searchable(encoding):
+    """Check whether files in `encoding` can be read by this module."""
+    return codecs.lookup(encoding).name in BYTE_SEARCHABLE_ENCODINGS
+
+
+def _read_data(fp, entry_sep, encoding):
+    try:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except ValueError:  # empty file
+        return b'', False
+    if data.find(b'\r') == -1:
+        return data, False
+    if '\r' in entry_sep or '\n' in entry_sep:
+        # The separator may span a line break, so we have to normalise the
+        # line breaks before searching for it.
+        normalised = data[:].replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+        data.close()
+        return normalised, False
+    return data, True
+
+
+def iter_blocks(path, entry_sep, encoding='utf-8'):
+    """
+    Yield the blocks of text between the occurrences of `entry_sep` in an SFM file.
+
+    Like reading the file in text mode, line breaks are normalised to `\\n`.
+
+    :return: Generator of triples (start, end, text), where `start` and `end` are the \
+    byte offsets of the block in the file (or in the file content with normalised line \
+    breaks, if the separator spans a line break and the file uses `\\r`).
+    """
+    sep = entry_sep.encode(encoding)
+    with open(path, 'rb') as fp:
+        data, has_cr = _read_data(fp, entry_sep, encoding)
+        try:
+            start = 0
+            while start is not None:
+                end = data.find(sep, start)
+                if end == -1:
+                    end, next_start = len(data), None
+                else:
+                    next_start = end + len(sep)
+                text = data[start:end].decode(encoding)
+                if has_cr:
+                    text = text.replace('\r\n', '\n').replace('\r', '\n')
+                yield start, end, text
+                start = next_start
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+
+def split_block(block, keep_empty=False, marker_map=None):
+    """
+    Split a block of text into (marker, value) pairs.
+
+    This mirrors `clldutils.sfm.marker_split` (as applied by `clldutils.sfm.parse`):
+    Values are stripped, lines of continued values are stripped and SFM header lines (i.e.
+    lines starting with `\\_`) are ignored.
+
+    :param marker_map: A dict used to map marker names.
+    """
+    get_marker = (marker_map or {}).get
+    pairs = []
+    parts = MARKER_SPLIT_PATTERN.split(block)
+    for marker, text in zip(parts[1::2], parts[2::2]):
+        if '\n' in text.rstrip():
+            # Note: The first line is the rest of the marker line, so it is
+            # never mistaken for a header line.
+            first, *lines = text.split('\n')
+            value = '\n'.join(
+                [first.strip()]
+                + [line.strip() for line in lines if not line.strip().startswith('\\_')])
+            value = value.strip()
+        else:
+            value = text.strip()
+        if value or keep_empty:
+            pairs.append((get_marker(marker, marker), value))
+    return pairs
+
+
+def read_entries(
+    path,
+    encoding='utf-8',
+    marker_map=None,
+    entry_impl=Entry,
+    entry_sep='\n\n',
+    entry_prefix=None,
+    keep_empty=False,
+):
+    """
+    Read entries from an SFM file.
+
+    The arguments have the same meaning as for `clldutils.sfm.SFM.read`.
+
+    :return: Generator of `entry_impl` instances.
+    """
+    entry_prefix = entry_prefix or entry_sep
+    for _, _, block in iter_blocks(path, entry_sep, encoding):
+        if not block.strip():
+            continue
+        pairs = split_block(entry_prefix + block, keep_empty=keep_empty, marker_map=marker_map)
+        if pairs:
+            yield entry_impl(pairs)
+
+
+def _read(filename, encoding, **kw):
+    if is_byte_searchable(encoding):
+        return read_entries(filename, encoding=encoding, **kw)
+    entries = SFM()
+    SFM.read(entries, filename, encoding=encoding, **kw)
+    return entries
+
+
+def _cache_key(path, encoding, kw):
+    stat = path.stat()
+    return (
+        CACHE_VERSION,
+        str(path),
+        stat.st_mtime_ns,
+        stat.st_size,
+        codecs.lookup(encoding).name,
+        sorted((kw.get('marker_map') or {}).items()),
+        kw.get('entry_sep', '\n\n'),
+        kw.get('entry_prefix'),
+        kw.get('keep_empty', False))
+
+
+def read_into(sfm, filename, encoding='utf-8', entry_impl=Entry, cache_dir=None, **kw):
+    """
+    Extend the `clldutils.sfm.SFM` instance `sfm` by entries read from a file.
+
+    The arguments have the same meaning as for `clldutils.sfm.SFM.read`, which is used for
+    encodings the fast reader cannot handle.
+
+    :param cache_dir: Directory to cache the parsed entries in.  The cache is invalidated \
+    when the file (i.e. its modification time or size) or the arguments change.
+    """
+    if not cache_dir:
+        with paused_gc():
+            sfm.extend(_read(filename, encoding, entry_impl=entry_impl, **kw))
+        return
+
+    path = Path(filename).resolve()
+    key = _cache_key(path, encoding, kw)
+    cache_path = Path(cache_dir) / '{}-{}.marshal'.format(
+        path.name, md5(str(path).encode('utf-8')).hexdigest())
+    entries = read_cache(cache_path, key, serializer=marshal)
+    with paused_gc():
+        if entries is None:
+            entries = list(_read(path, encoding, entry_impl=list, **kw))
+            write_cache(cache_path, key, entries, serializer=marshal)
+        sfm.extend(entry_impl(entry) for entry in entries)
@@ -1,7 +1,17 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import gc
+import hashlib
+import marshal
+import os
+import pickle
 import re
+import threading
 
 from clldutils import jsonlib
 from clldutils.path import Path
+from clldutils.sfm import Entry
 
 
 ID_SEP_PATTERN = re.compile(r',|;')
@@ -11,6 +21,281 @@ def split_ids(s, sep=ID_SEP_PATTERN):
     return sorted({id_.strip() for id_ in sep.split(s) if id_.strip()})
 
 
+class IndexedEntry(Entry):
+    """
+    SFM entry, which keeps an index of the positions of its markers.
+
+    Scanning a handful of (marker, content) pairs is cheaper than maintaining an index, so
+    the index is only used for entries with at least `index_threshold` pairs.  It is built on
+    the first lookup and dropped whenever the entry is modified by anything other than `append`
+    (appended pairs are added to the index on the next lookup).
+    """
+    __slots__ = ('_index', '_indexed')
+    _state_slots = ()
+
+    #: Minimal number of (marker, content) pairs for an entry to be indexed.
+    index_threshold = 64
+
+    def __init_subclass__(cls, **kw):
+        super().__init_subclass__(**kw)
+        cls._state_slots = tuple(
+            name
+            for c in cls.__mro__
+            for name in c.__dict__.get('__slots__', ())
+            if name not in IndexedEntry.__slots__)
+
+    def __new__(cls, *args, **kw):
+        self = super().__new__(cls, *args, **kw)
+        self._index = None
+        return self
+
+    def __copy__(self):
+        new = self.__class__(self)
+        for name in self._state_slots:
+            if hasattr(self, name):
+                setattr(new, name, getattr(self, name))
+        if self.__dict__:
+            new.__dict__.update(self.__dict__)
+        return new
+
+    def __getstate__(self):
+        # Unpickled entries rebuild the index themselves, so we only pass on
+        # the instance attributes.
+        slots = {
+            name: getattr(self, name)
+            for name in self._state_slots
+            if hasattr(self, name)}
+        return self.__dict__ or None, slots
+
+    def _update_index(self):
+        if self._index is None:
+            self._index = {}
+            self._indexed = 0
+        index = self._index
+        for i in range(self._indexed, len(self)):
+            marker = self[i][0]
+            if marker in index:
+                index[marker].append(i)
+            else:
+                index[marker] = [i]
+        self._indexed = len(self)
+        return index
+
+    def positions(self, marker):
+        """Return the positions of all (marker, content) pairs for `marker`."""
+        if len(self) < self.index_threshold:
+            return [i for i, (k, _) in enumerate(self) if k == marker]
+        index = self._index
+        if index is None or self._indexed != len(self):
+            index = self._update_index()
+        return index.get(marker, ())
+
+    def get(self, key, default=None):
+        if len(self) < self.index_threshold:
+            for k, v in self:
+                if k == key:
+                    return v
+            return default
+        index = self._index
+        if index is None or self._indexed != len(self):
+            index = self._update_index()
+        positions = index.get(key)
+        return self[positions[0]][1] if positions else default
+
+    def getall(self, key):
+        if len(self) < self.index_threshold:
+            return [v for k, v in self if k == key]
+        return [self[i][1] for i in self.positions(key)]
+
+    def __setitem__(self, index, value):
+        self._index = None
+        return super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        self._index = None
+        return super().__delitem__(index)
+
+    def __iadd__(self, other):
+        self._index = None
+        return super().__iadd__(other)
+
+    def __imul__(self, n):
+        self._index = None
+        return super().__imul__(n)
+
+    def extend(self, pairs):
+        self._index = None
+        return super().extend(pairs)
+
+    def insert(self, index, pair):
+        self._index = None
+        return super().insert(index, pair)
+
+    def pop(self, *args):
+        self._index = None
+        return super().pop(*args)
+
+    def remove(self, pair):
+        self._index = None
+        return super().remove(pair)
+
+    def clear(self):
+        self._index = None
+        return super().clear()
+
+    def sort(self, **kw):
+        self._index = None
+        return super().sort(**kw)
+
+    def reverse(self):
+        self._index = None
+        return super().reverse()
+
+
+@contextmanager
+def paused_gc():
+    """
+    Context manager, which disables the cyclic garbage collector.
+
+    Creating lots of container objects at once (e.g. when reading big files) triggers the
+    collector over and over, each time traversing everything read so far.
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def read_cache(path, key, serializer=pickle):
+    """
+    Read data written to a cache file by `write_cache`.
+
+    :param key: The key the data must have been stored under.
+    :param serializer: The module the data was written with (`pickle` or `marshal`).
+    :return: The cached data or `None`, if the cache is missing, unreadable or stale.
+    """
+    try:
+        # Note: `marshal.load` reads files in tiny chunks, so we read the file
+        # at once.
+        with paused_gc(), open(path, 'rb') as f:
+            stored_key, data = serializer.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError, AttributeError, ImportError,
+            pickle.UnpicklingError):
+        return None
+    return data if stored_key == key else None
+
+
+def write_cache(path, key, data, serializer=pickle):
+    """
+    Write `data` to a cache file at `path`, tagged with `key`.
+
+    :param serializer: Module to serialize the data with, i.e. `pickle` or - for data made up \
+    of builtin types only - the faster `marshal`.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(serializer.dumps((key, data)))
+    os.replace(tmp, path)
+
+
+def _md5_file(path, chunk_size):
+    checksum = hashlib.md5()
+    buf = bytearray(chunk_size)
+    view = memoryview(buf)
+    with open(path, 'rb') as f:
+        while (n := f.readinto(buf)):
+            checksum.update(view[:n])
+    return checksum.hexdigest()
+
+
+class ChecksumCache:
+    """
+    Persistent cache of md5 checksums of files.
+
+    Checksums are stored together with the size and modification time of a file, so looking
+    up the checksum of an unchanged file only costs a `stat` call.
+
+    :param path: Path of the cache file, or `None` to keep the checksums in memory only.
+    """
+    # Version of the format of the cache; must be increased whenever it changes.
+    version = 1
+    chunk_size = 2 ** 20
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else None
+        self.checksums = (
+            read_cache(self.path, self.version, serializer=marshal) if self.path else None) or {}
+        self.changed = False
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.save()
+
+    def md5(self, path):
+        """Return the md5 checksum of a file, hashing it only if it changed."""
+        stat = os.stat(path)
+        key = os.path.abspath(path)
+        cached = self.checksums.get(key)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        checksum = _md5_file(path, self.chunk_size)
+        with self._lock:
+            self.checksums[key] = (stat.st_size, stat.st_mtime_ns, checksum)
+            self.changed = True
+        return checksum
+
+    def map(self, paths, workers=4):
+        """
+        Compute the checksums of several files, hashing up to `workers` files at a time.
+
+        :return: Generator of pairs (path, md5 checksum) in the order of `paths`.
+        """
+        if not workers or workers < 2:
+            yield from ((path, self.md5(path)) for path in paths)
+            return
+        with ThreadPoolExecutor(workers) as pool:
+            pending = deque()
+            for path in paths:
+                pending.append((path, pool.submit(self.md5, path)))
+                if len(pending) > 2 * workers:
+                    path, future = pending.popleft()
+                    yield path, future.result()
+            while pending:
+                path, future = pending.popleft()
+                yield path, future.result()
+
+    def merge(self, other):
+        """Add the checksums computed by a copy of the cache (e.g. in another process)."""
+        if other.changed:
+            with self._lock:
+                self.checksums.update(other.checksums)
+                self.changed = True
+
+    def save(self):
+        """Write the cache to disk, if checksums were added."""
+        if self.path and self.changed:
+            with self._lock:
+                write_cache(self.path, self.version, self.checksums, serializer=marshal)
+                self.changed = False
+
+
 class MediaCatalog:
     def __init__(self, repos):
         self.path = Path(repos).joinpath('cdstar.json')
@@ -26,7 +311,18 @@ class MediaCatalog:
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        jsonlib.dump(self.items, self.path, indent=4)
+        self.save()
+
+    def save(self):
+        """
+        Write the catalog to disk.
+
+        The file is replaced atomically, so that an interrupted run never leaves a truncated
+        catalog behind.
+        """
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        jsonlib.dump(self.items, tmp, indent=4)
+        os.replace(tmp, self.path)
 
     def add(self, obj, **kw):
         """
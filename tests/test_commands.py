@@ -5,7 +5,13 @@ import shutil
 
 import pytest
 
+from cdstarcat.catalog import Catalog
 from cldfbench.__main__ import main
+from clldutils.path import md5
+
+from pydictionaria import sfm2cldf
+from pydictionaria.commands.upload_media import CdstarUploader, DryRunUploader, upload_dir
+from pydictionaria.util import MediaCatalog
 
 
 MOCK_STDIN = """\
@@ -67,6 +73,35 @@ def test_makecldf_with_examples(sfm_dataset_with_examples, mocker):
     assert (sfm_dataset_with_examples / 'cldf' / 'cldf-metadata.json').exists()
 
 
+def test_makecldf_unchanged_input(sfm_dataset_with_examples, mocker):
+    mocker.patch('cldfbench.__main__.BUILTIN_CATALOGS', [])
+    script = sfm_dataset_with_examples / 'cldfbench_testbench.py'
+
+    def output():
+        paths = [*(sfm_dataset_with_examples / 'cldf').iterdir(),
+                 *sfm_dataset_with_examples.glob('*.log')]
+        return {p.name: p.read_bytes() for p in paths}
+
+    _main(f"makecldf '{script}'")
+    written = output()
+    assert written['cldf.log']
+
+    # The conversion is skipped, while the input does not change ...
+    process = mocker.patch(
+        'pydictionaria.sfm2cldf.process_dataset', side_effect=AssertionError)
+    _main(f"makecldf '{script}'")
+    assert output() == written
+
+    # ... but is run again, once it does.
+    mocker.stop(process)
+    process = mocker.spy(sfm2cldf, 'process_dataset')
+    with (sfm_dataset_with_examples / 'raw' / 'db.sfm').open('a', encoding='utf-8') as f:
+        f.write('\n\\lx new\n\\ps n\n\\de new\n')
+    _main(f"makecldf '{script}'")
+    assert process.call_count == 1
+    assert b'new' in output()['entries.csv']
+
+
 def test_makecldf_with_flex_ref(sfm_dataset_flex_ref, mocker):
     mocker.patch('cldfbench.__main__.BUILTIN_CATALOGS', [])
     _main("makecldf '{}'".format(sfm_dataset_flex_ref / 'cldfbench_testbench.py'))
@@ -77,3 +112,62 @@ def test_release(sfm_dataset_with_examples):
     _main("dictionaria.release '{}'".format(sfm_dataset_with_examples / 'cldfbench_testbench.py'))
     assert (sfm_dataset_with_examples / 'README.md').exists()
     assert (sfm_dataset_with_examples / '.zenodo.json').exists()
+
+
+def test_upload_media_dry_run(sfm_dataset, tmp_path):
+    (tmp_path / 'upload' / 'audio').mkdir(parents=True)
+    (tmp_path / 'upload' / 'audio' / 'a.wav').write_bytes(b'a')
+    _main("dictionaria.upload_media '{}' --media-dir '{}' --dry-run --checkpoint-interval 0".format(
+        sfm_dataset / 'cldfbench_testbench.py', tmp_path / 'upload'))
+    assert not (sfm_dataset / 'etc' / 'cdstar.json').exists()
+
+
+def test_cdstar_uploader(tmp_path, mocker):
+    def create(self, path, metadata, filter_=None, object_class=None):
+        obj = DryRunUploader().upload(path, md5(path), metadata)
+        self[obj.id] = obj
+        yield path, True, obj
+
+    create = mocker.patch.object(Catalog, 'create', autospec=True, side_effect=create)
+    fname = tmp_path / 'a.wav'
+    fname.write_bytes(b'a')
+    uploader = CdstarUploader(Catalog(tmp_path / 'catalog.json'))
+    obj = uploader.upload(fname, md5(fname), {'collection': 'dictionaria'})
+    assert uploader.upload(fname, md5(fname), {'collection': 'dictionaria'}) is obj
+    assert create.call_count == 1
+    uploader.checkpoint()
+    assert list(Catalog(tmp_path / 'catalog.json').objects) == [obj.id]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['a.wav', 'catalog.json']
+
+
+def test_upload_dir_resumes(tmp_path):
+    media_dir = tmp_path / 'audio'
+    media_dir.mkdir()
+    for name in 'abcdef':
+        (media_dir / f'{name}.wav').write_bytes(name.encode())
+    (media_dir / 'copy.wav').write_bytes(b'a')
+
+    class Uploader(DryRunUploader):
+        def __init__(self, fail=None):
+            self.fail, self.uploaded = fail, []
+
+        def upload(self, fname, checksum, metadata):
+            if fname.name == self.fail:
+                raise ValueError(fname)
+            self.uploaded.append(fname.name)
+            return super().upload(fname, checksum, metadata)
+
+    uploader = Uploader(fail='d.wav')
+    with pytest.raises(ValueError):
+        with MediaCatalog(tmp_path) as mcat:
+            upload_dir(media_dir, mcat, uploader, 'dict', workers=2, checkpoint_interval=0)
+    assert 'd.wav' not in uploader.uploaded
+    assert len(MediaCatalog(tmp_path).items) == len(uploader.uploaded)
+
+    resumed = Uploader()
+    with MediaCatalog(tmp_path) as mcat:
+        upload_dir(media_dir, mcat, resumed, 'dict', workers=2)
+    assert sorted(uploader.uploaded + resumed.uploaded) == [f'{n}.wav' for n in 'abcdef']
+    items = MediaCatalog(tmp_path).items
+    assert len(items) == 6
+    assert {item['fname'] for item in items.values()} == {f'{n}.wav' for n in 'abcdef'}
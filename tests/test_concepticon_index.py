@@ -0,0 +1,49 @@
+import pytest
+from pyconcepticon import Concepticon
+
+from pydictionaria.concepticon_index import ConcepticonIndex, concepticon_version
+
+GLOSSES = ['DOG', 'WATER', 'EAT', 'HOT WATER', 'BLACK DOG', 'EAT (SOMETHING)', 'THE DOG']
+
+
+@pytest.fixture
+def concepticon_repos(tmp_path):
+    (tmp_path / 'mappings').mkdir()
+    (tmp_path / 'mappings' / 'map-en.tsv').write_text(
+        'ID\tGLOSS\n' + ''.join(
+            f'{i}\t{gloss.lower()}\n' for i, gloss in enumerate(GLOSSES, start=1)),
+        encoding='utf-8')
+    (tmp_path / 'concepticondata').mkdir()
+    (tmp_path / 'concepticondata' / 'concepticon.json').write_text(
+        '{"COLUMN_TYPES": {}, "SEMANTICFIELD": [], "ONTOLOGICAL_CATEGORY": []}')
+    (tmp_path / 'concepticondata' / 'concepticon.tsv').write_text(
+        'ID\tGLOSS\tSEMANTICFIELD\tDEFINITION\tONTOLOGICAL_CATEGORY\tREPLACEMENT_ID\n'
+        + ''.join(
+            f'{i}\t{gloss}\t\tdefinition {i}\t\t\n' for i, gloss in enumerate(GLOSSES, start=1)),
+        encoding='utf-8')
+    return tmp_path
+
+
+def test_lookup(concepticon_repos):
+    concepticon = Concepticon(concepticon_repos)
+    index = ConcepticonIndex.from_concepticon(concepticon)
+    for entries in [
+        ['dog', 'black dog', 'water'],
+        ['to eat', 'eat', 'the dog'],
+        ['hot', 'cold', 'dog (n.)'],
+    ]:
+        for similarity_level in [5, 9]:
+            assert list(index.lookup(entries, similarity_level=similarity_level)) \
+                == list(concepticon.lookup(entries, similarity_level=similarity_level))
+    assert index.conceptsets['2'].gloss == 'WATER'
+    assert index.conceptsets['2'].definition == 'definition 2'
+
+
+def test_from_repos(concepticon_repos, tmp_path):
+    cache_dir = tmp_path / 'cache'
+    index = ConcepticonIndex.from_repos(concepticon_repos, cache_dir=cache_dir)
+    assert len(list(cache_dir.iterdir())) == 1
+    cached = ConcepticonIndex.from_repos(concepticon_repos, cache_dir=cache_dir)
+    assert concepticon_version(cached) == concepticon_version(Concepticon(concepticon_repos))
+    assert list(cached.lookup(['water'])) == list(index.lookup(['water']))
+    assert cached.conceptsets == index.conceptsets
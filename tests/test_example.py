@@ -1,6 +1,8 @@
 from pathlib import Path
 
-from pydictionaria.example import Corpus, Examples, Example, concat_multilines
+from pydictionaria.example import (
+    Corpus, CorpusIndex, Examples, Example, concat_multilines,
+)
 
 
 EAF_SFM = """
@@ -42,6 +44,23 @@ def test_example_obj():
     assert ex.alt_translation2 is None
 
 
+def test_example_id():
+    ex1 = Example([('tx', 'A text.'), ('ft', 'Translation')])
+    ex2 = Example([('tx', 'a text'), ('ft', 'translation')])
+    assert ex1.id == ex2.id
+    # The derived ID is appended rather than inserted before the other pairs,
+    # but still written first.
+    assert ex1[-1] == ('ref', ex1.id)
+    assert str(ex1).startswith('\\ref {}\n'.format(ex1.id))
+    # Once derived, the ID is kept.
+    ex1.set('tx', 'Another text')
+    assert ex1.id == ex2.id
+    assert Example([('tx', 'Another text'), ('ft', 'Translation')]).id != ex2.id
+    ex3 = Example([('ref', ''), ('tx', 'A text.'), ('ft', 'Translation')])
+    ex3_id = ex3.id
+    assert ex3[0] == ('ref', ex3_id) and len(ex3) == 3
+
+
 def test_examples_obj():
     ex = Examples([Example.from_string(NORM_EXAMPLE + '\n\\mb more morphemes')])
     ex.visit(concat_multilines)
@@ -49,6 +68,31 @@ def test_examples_obj():
         ['Enaa', 'a', 'hena', '-naa', 'e', 'Ruth', 'Iarabee', 'more', 'morphemes']
 
 
+def test_examples_index():
+    def example(ref, text='text'):
+        return Example([('ref', ref), ('tx', text)])
+
+    ex = Examples([example('a'), example('b')])
+    assert ex.get('a') is ex[0]
+    ex.append(example('c'))
+    assert ex.get('c') is ex[2]
+    ex.append(example('a', 'other'))
+    assert ex.get('a') is ex[3]
+    ex[3] = example('d')
+    assert ex.get('a') is ex[0]
+    assert ex.get('d') is ex[3]
+    del ex[0]
+    assert ex.get('a') is None
+
+    def rename(e):
+        if e.get('ref') == 'b':
+            e[0] = ('ref', 'e')
+
+    ex.visit(rename)
+    assert ex.get('b') is None
+    assert ex.get('e') is ex[0]
+
+
 def test_corpus_obj(tmpdir):
     c = Corpus.from_dir(Path(str(tmpdir)))
     assert c.get('key') is None
@@ -62,3 +106,39 @@ def test_corpus_obj(tmpdir):
     example.set('lemma', 'x')
     example.set('lemma', 'y')
     assert example.lemmas == ['x', 'y']
+
+
+def test_corpus_index(tmp_path):
+    (tmp_path / 'a.eaf.sfm').write_text(
+        EAF_SFM + '\n\\utterance_id Iar_02RG.003\n  continued\n\\utterance Text.\n',
+        'utf8')
+    cache_dir = tmp_path / 'cache'
+    index = CorpusIndex.from_dir(tmp_path, cache_dir=cache_dir)
+    assert set(index.locations) == {'Iar_02RG.002', 'Iar_02RG.003\ncontinued'}
+    assert len(list(cache_dir.iterdir())) == 1
+    assert CorpusIndex.from_dir(tmp_path, cache_dir=cache_dir).locations == index.locations
+
+    assert str(index.get('Iar_02RG.002')) == NORM_EXAMPLE
+    assert index.get('Iar_02RG.002') is index.get('Iar_02RG.002')
+    assert index.get('Iar_02RG.003\ncontinued').text == 'Text.'
+    assert index.get('Iar_02RG.004') is None
+
+
+def test_corpus_index_version(tmp_path, monkeypatch):
+    from pydictionaria import example, sfm_reader
+
+    (tmp_path / 'a.eaf.sfm').write_text(EAF_SFM, 'utf8')
+    cache_dir = tmp_path / 'cache'
+    locations = CorpusIndex.from_dir(tmp_path, cache_dir=cache_dir).locations
+
+    scans = []
+    scan = CorpusIndex._scan.__func__
+    monkeypatch.setattr(
+        CorpusIndex, '_scan', classmethod(lambda cls, paths: scans.append(1) or scan(cls, paths)))
+    monkeypatch.setattr(sfm_reader, 'CACHE_VERSION', sfm_reader.CACHE_VERSION + 1)
+    assert CorpusIndex.from_dir(tmp_path, cache_dir=cache_dir).locations == locations
+    assert not scans
+
+    monkeypatch.setattr(example, 'CORPUS_INDEX_VERSION', example.CORPUS_INDEX_VERSION + 1)
+    assert CorpusIndex.from_dir(tmp_path, cache_dir=cache_dir).locations == locations
+    assert scans
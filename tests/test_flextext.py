@@ -1,4 +1,8 @@
+import io
+from pathlib import Path
+import tempfile
 import unittest
+from unittest.mock import Mock
 import xml.etree.ElementTree as ET
 
 import pydictionaria.flextext as f
@@ -328,6 +332,122 @@ class ExampleSeparation(unittest.TestCase):
         self.assertEqual(examples[0]['languages'], {'lang1', 'lang2', 'lang3'})
         self.assertTrue(examples[0]['example'])
 
+    def test_ignore_titles_within_text(self):
+        doc = ET.Element('document')
+        text = ET.SubElement(doc, 'interlinear-text')
+        pars = ET.SubElement(text, 'paragraphs')
+        par = ET.SubElement(pars, 'paragraph')
+        phrases = ET.SubElement(par, 'phrases')
+        phrase = ET.SubElement(phrases, 'phrase')
+        segnum = ET.SubElement(phrase, 'item', type='segnum')
+        segnum.text = '1'
+        phrase_title = ET.SubElement(phrase, 'item', type='title-abbreviation')
+        phrase_title.text = 'ID_2'
+        title = ET.SubElement(text, 'item', type='title')
+        title.text = 'ID_1'
+        languages = ET.SubElement(text, 'languages')
+        ET.SubElement(languages, 'language', lang='lang1', vernacular='true')
+
+        examples = list(f.separate_examples(doc))
+        self.assertEqual(len(examples), 1)
+        self.assertEqual(examples[0]['text_id'], 'ID_1')
+
+
+class StreamingExampleSeparation(unittest.TestCase):
+
+    def _text(self, doc, text_id, segnums):
+        text = ET.SubElement(doc, 'interlinear-text')
+        title = ET.SubElement(text, 'item', type='title')
+        title.text = text_id
+        pars = ET.SubElement(text, 'paragraphs')
+        par = ET.SubElement(pars, 'paragraph')
+        phrases = ET.SubElement(par, 'phrases')
+        for segnum in segnums:
+            phrase = ET.SubElement(phrases, 'phrase')
+            item = ET.SubElement(phrase, 'item', type='segnum')
+            item.text = segnum
+        languages = ET.SubElement(text, 'languages')
+        ET.SubElement(languages, 'language', lang='lang1', vernacular='true')
+
+    def test_same_examples_as_separate_examples(self):
+        doc = ET.Element('document')
+        self._text(doc, 'ID_1', ['1.1', '1.2', '2'])
+        self._text(doc, 'ID_2', ['1'])
+        expected = [
+            (ex['text_id'], ex['segnum'], [ET.tostring(p) for p in ex['example']])
+            for ex in f.separate_examples(doc)]
+
+        examples = [
+            (ex['text_id'], ex['segnum'], [ET.tostring(p) for p in ex['example']])
+            for ex in f.iterparse_examples(io.BytesIO(ET.tostring(doc)))]
+        self.assertEqual(examples, expected)
+        self.assertEqual(
+            [(text_id, segnum) for text_id, segnum, _ in examples],
+            [('ID_1', '1'), ('ID_1', '2'), ('ID_2', '1')])
+
+    def test_missing_texts(self):
+        doc = ET.Element('document')
+        _not_text = ET.SubElement(doc, 'not-an-interlinear-text')
+        self._text(_not_text, 'ID_1', ['1'])
+        log = Mock()
+
+        examples = list(f.iterparse_examples(io.BytesIO(ET.tostring(doc)), log))
+        self.assertEqual(examples, [])
+        log.warn.assert_called_once_with('XML data does not contain any interlinear texts.')
+
+    def test_find_text_spans(self):
+        data = b'<?xml version="1.0"?>\n<document>\n <interlinear-text a=">">' \
+            b'<interlinear-text/></interlinear-text> <interlinear-text/></document>\n'
+        self.assertEqual(
+            [data[start:end] for start, end in f.find_text_spans(data)],
+            [b'<interlinear-text a=">"><interlinear-text/></interlinear-text>',
+             b'<interlinear-text/>'])
+        self.assertIsNone(f.find_text_spans(data.replace(b' <inter', b'<!-- --><inter')))
+        self.assertIsNone(f.find_text_spans(data.replace(b'document', b'doc')))
+        self.assertIsNone(
+            f.find_text_spans(b'<?xml version="1.0" encoding="UTF-16"?><document/>'))
+
+    def _glossed_document(self, text_ids):
+        doc = ET.Element('document')
+        for text_id in text_ids:
+            self._text(doc, text_id, ['1.1', '1.2', '2'])
+        ET.SubElement(doc, 'interlinear-text')
+        for phrase in doc.iter('phrase'):
+            word = ET.SubElement(ET.SubElement(phrase, 'words'), 'word')
+            ET.SubElement(word, 'item', type='txt').text = 'word'
+        return ET.tostring(doc)
+
+    def test_parse_in_parallel(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'glosses.flextext'
+            path.write_bytes(self._glossed_document(['ID_1', 'ID_2']))
+            expected_log, log = Mock(), Mock()
+            expected = list(f.parse_flextext(str(path), expected_log))
+            self.assertEqual(list(f.parse_flextext(str(path), log, workers=2)), expected)
+        self.assertEqual(len(expected), 4)
+        self.assertEqual(log.warn.call_args_list, expected_log.warn.call_args_list)
+        self.assertTrue(log.warn.called)
+
+    def test_parse_cached(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = Path(tmp_dir) / 'glosses.flextext'
+            cache_dir = Path(tmp_dir) / 'cache'
+
+            def parse():
+                log = Mock()
+                return list(f.parse_flextext(str(path), log, cache_dir=cache_dir)), log
+
+            path.write_bytes(self._glossed_document(['ID_1']))
+            expected, expected_log = parse()
+            self.assertEqual(len(list(cache_dir.iterdir())), 1)
+            examples, log = parse()
+            self.assertEqual(examples, expected)
+            self.assertEqual(log.warn.call_args_list, expected_log.warn.call_args_list)
+
+            path.write_bytes(self._glossed_document(['ID_1', 'ID_2']))
+            examples, _ = parse()
+            self.assertEqual([ex['text_id'] for ex in examples], ['ID_1'] * 2 + ['ID_2'] * 2)
+
 
 class GlossExtraction(unittest.TestCase):
 
@@ -0,0 +1,21 @@
+import pytest
+
+from pydictionaria.headwords import HeadwordMatcher
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('', []),
+    ('a dog 2 and a hot dog; dog2.', ['dog 2', 'hot dog', 'dog2']),
+    ('hot dog 2', ['hot dog']),
+    ('doggy hotdog', []),
+    ('word-ka a-bc', ['-ka']),
+])
+def test_finditer(text, expected):
+    matcher = HeadwordMatcher(['dog', 'dog 2', 'dog2', 'hot dog', 'a-b', '-ka', '?'])
+    assert [m.group() for m in matcher.finditer(text)] == expected
+
+
+def test_sub():
+    matcher = HeadwordMatcher(['ab', 'b c', 'c'])
+    assert matcher.sub(lambda m: '<{}>'.format(m.group()), 'ab c, b c!') == '<ab> <c>, <b c>!'
+    assert matcher.sub(lambda m: '', 'nothing') == 'nothing'
@@ -1,3 +1,6 @@
+import copy
+import pickle
+import pytest
 import unittest
 import pydictionaria.sfm2cldf as s
 from clldutils import sfm
@@ -206,6 +209,59 @@ class LinkProcessing(unittest.TestCase):
         self.assertEqual(new_entry, expected)
 
 
+class HeadwordLinkProcessing(unittest.TestCase):
+
+    def test_link_headwords(self):
+        entries = sfm.SFM([
+            sfm.Entry([('lx', 'dog'), ('hm', '2')]),
+            sfm.Entry([('lx', 'hot dog')])])
+        for entry, id_ in zip(entries, ['dog_2', 'hot_dog']):
+            entry.id = id_
+            entry.original_id = entry.get('lx')
+        properties = {
+            'process_links_in_markers': {'de'},
+            'link_label_marker': 'lx',
+            'link_mode': 'headwords'}
+        link_processor = s.make_link_processor(properties, s.make_id_index(entries), entries)
+        new_entry = link_processor(sfm.Entry([('de', 'see dog 2 or hot dog')]))
+        self.assertEqual(
+            new_entry.get('de'), 'see [dog](dog_2) or [hot dog](hot_dog)')
+
+    def test_unknown_link_mode(self):
+        properties = {
+            'process_links_in_markers': {'de'},
+            'link_label_marker': 'lx',
+            'link_mode': 'magic'}
+        with self.assertRaises(ValueError):
+            s.make_link_processor(properties, {}, [])
+
+
+class ReferenceRewriting(unittest.TestCase):
+
+    def setUp(self):
+        id_index = {'OLDID1': 'NEWID1', 'OLDID2': 'NEWID2'}
+        label_index = {'NEWID1': 'label 1', 'NEWID2': 'label 2'}
+        self.crossrefs = s.CrossRefs(id_index, {'cf', 'both'})
+        self.links = s.LinkProcessor(
+            id_index, label_index, {'de', 'both'}, r'\bOLDID\d+\b')
+
+    def test_same_result_as_separate_processors(self):
+        original_entry = sfm.Entry([
+            ('cf', 'OLDID2; OLDID1; OLDID3'),
+            ('de', 'see OLDID1'),
+            ('both', 'OLDID2'),
+            ('othermarker', 'OLDID1')])
+        expected = self.links(self.crossrefs(original_entry))
+        rewriter = s.ReferenceRewriter(self.crossrefs, self.links, None)
+        self.assertEqual(rewriter(original_entry), expected)
+
+    def test_rewrite_in_place(self):
+        original_entry = sfm.Entry([('de', 'see OLDID1')])
+        new_entry = s.ReferenceRewriter(self.links)(original_entry)
+        self.assertIs(new_entry, original_entry)
+        self.assertEqual(original_entry, sfm.Entry([('de', 'see [label 1](NEWID1)')]))
+
+
 class MediaCaptionExtraction(unittest.TestCase):
 
     def test_find_caption(self):
@@ -330,3 +386,114 @@ def test_multimarkers():
     sfm_entry = sfm.Entry([('cf', 'val1'), ('cf', 'val2')])
     cldf_row = s.sfm_entry_to_cldf_row(None, {'cf': 'See_Also'}, {}, set(), sfm_entry)
     assert cldf_row['See_Also'] == 'val1 ; val2'
+
+
+def test_row_builder():
+    builder = s.RowBuilder(
+        'ExampleTable',
+        {'tx': 'Primary_Text', 'gl': 'Gloss', 'cf': 'Entry_IDs', 'nt': 'Comment'},
+        {'src': 'Primary_Text'},
+        {'Entry_IDs'},
+        'lang1')
+    sfm_entry = sfm.Entry([
+        ('tx', 'a  b\n'), ('gl', 'A\tB'), ('cf', 'x; y'), ('nt', ''), ('src', 'Meier 2000')])
+    sfm_entry.id = 'ex1'
+    assert builder(sfm_entry) == {
+        'ID': 'ex1',
+        'Language_ID': 'lang1',
+        'Primary_Text': 'a b',
+        'Gloss': ['A', 'B'],
+        'Entry_IDs': ['x', 'y'],
+        'Source': ['Meier 2000[Primary_Text]'],
+    }
+    assert builder(sfm.Entry([('nt', 'comment')])) == {
+        'Language_ID': 'lang1', 'Comment': 'comment'}
+
+
+def test_used_columns():
+    rows = [{'ID': '1', 'Name': ''}, {'ID': '2', 'Comment': 'c'}]
+    assert s._used_columns(rows) == ['Comment', 'ID']
+
+
+def test_columns_added_to_rows(tmp_path):
+    from pycldf import Dictionary
+
+    builder = s.RowBuilder('SenseTable', {'de': 'Description'}, {}, set())
+    senses = [sfm.Entry([('de', 'meaning')])]
+    senses[0].id = 's1'
+    senses[0].entry_id = 'e1'
+    rows = [builder(sense) for sense in senses]
+    rows[0]['Scientific_Name'] = 'Canis lupus'
+    rows.append({'ID': 's2', 'Entry_ID': 'e1', 'Comment': 'added'})
+
+    cldf = Dictionary.in_dir(tmp_path)
+    s.make_cldf_schema(cldf, {}, [], rows, [], [])
+    columns = {col.name for col in cldf['SenseTable'].tableSchema.columns}
+    assert {'Description', 'Scientific_Name', 'Comment'} <= columns
+
+
+def test_conversion_plan():
+    properties = {
+        'entry_map': {'lx': 'Headword', 'cf': 'See_Also'},
+        'sources': {'src': 'lx'},
+        'cross_references': ['cf'],
+        'gloss_ref': 'z0'}
+    plan = s.ConversionPlan.from_properties(properties)
+    assert s.ConversionPlan.from_properties(plan) is plan
+    assert plan.entry_table.mapping['lx'] == 'Headword'
+    assert plan.entry_table.mapping['ps'] == 'Part_Of_Speech'
+    assert plan.entry_table.source_refs == {'src': 'Headword'}
+    assert plan.entry_table.crossref_columns == {'See_Also', 'Main_Entry', 'Contains'}
+    assert plan.flexref_map['syn'] == 'sy'
+    assert plan.sense_sep == s.DEFAULT_SENSE_SEP
+    with pytest.raises(AttributeError):
+        plan.sense_sep = 'sn'
+    assert pickle.loads(pickle.dumps(plan)) == copy.deepcopy(plan) == plan
+    spec = s.make_spec(plan, {'lx', 'cf', 'src', 'de'})
+    assert spec == s.make_spec(properties, {'lx', 'cf', 'src', 'de'})
+    assert {'lx', 'cf', 'src', 'z0'} <= spec['entry_markers'] | spec['example_markers']
+
+
+def test_write_table(tmp_path, monkeypatch):
+    from pycldf import Dictionary
+
+    entries = [
+        {'ID': 'e1', 'Language_ID': 'l', 'Headword': 'a, "b"', 'Entry_IDs': ['e2', 'e3']},
+        {'ID': 'e2', 'Language_ID': 'l', 'Headword': 'c', 'Entry_IDs': []}]
+    media = [s.add_media_metadata(
+        {'m1': {'objid': 'obj', 'original': 'a.wav', 'mimetype': 'audio/wav', 'size': 3}},
+        {'ID': 'm1', 'Language_ID': 'l', 'Name': 'a.wav', 'Description': None})]
+    written = {}
+    for kind in ['csvw', 'direct']:
+        cldf = Dictionary.in_dir(tmp_path / kind)
+        s.make_cldf_schema(cldf, {}, entries, [], [], media)
+        if kind == 'csvw':
+            cldf.write(EntryTable=entries, MediaTable=media)
+        else:
+            assert s.write_table(cldf, 'EntryTable', entries) == 2
+            assert s.write_table(cldf, 'MediaTable', media, zipped=True) == 1
+            cldf.write()
+            assert not (tmp_path / kind / 'media.csv').exists()
+        written[kind] = {
+            table: [dict(row) for row in cldf[table]] for table in ['EntryTable', 'MediaTable']}
+        assert cldf['EntryTable'].common_props['dc:extent'] == 2
+    assert written['direct'] == written['csvw']
+    assert written['direct']['EntryTable'][0]['Entry_IDs'] == ['e2', 'e3']
+    assert (tmp_path / 'direct' / 'entries.csv').read_bytes() \
+        == (tmp_path / 'csvw' / 'entries.csv').read_bytes()
+
+    # Cells are looked up by the name of a column if its header differs.
+    from csvw.metadata import Column
+    monkeypatch.setattr(
+        Column, 'header', property(lambda col: 'Lemma' if col.name == 'Headword' else f'{col}'))
+    for kind in ['csvw', 'direct']:
+        cldf = Dictionary.in_dir(tmp_path / ('header_' + kind))
+        s.make_cldf_schema(cldf, {}, entries, [], [], [])
+        if kind == 'csvw':
+            cldf.write(EntryTable=entries)
+        else:
+            s.write_table(cldf, 'EntryTable', entries)
+    written = (tmp_path / 'header_direct' / 'entries.csv').read_text(encoding='utf-8')
+    assert written.splitlines()[0] == 'ID,Language_ID,Lemma,Part_Of_Speech,Entry_IDs'
+    assert '"a, ""b"""' in written
+    assert written == (tmp_path / 'header_csvw' / 'entries.csv').read_text(encoding='utf-8')
@@ -28,6 +28,39 @@ def test_entry_obj():
     assert e.get('new_marker') == 'value'
 
 
+def test_visitor_chain(tmp_path):
+    db_path = tmp_path / 'db.sfm'
+    db_path.write_text('\\lx a\n\\sd x__y\n\n\\lx b\n\n\\lx c\n', encoding='utf8')
+    db = sfm_lib.Database(db_path)
+    seen = []
+
+    def drop_b(entry):
+        return False if entry.get('lx') == 'b' else None
+
+    db.visit(sfm_lib.VisitorChain(sfm_lib.normalize, drop_b, None, seen.append))
+    assert [e.get('lx') for e in db] == ['a', 'c']
+    assert db[0].get('sd') == 'x y'
+    # Visitors after one dropping the entry are not run:
+    assert [e.get('lx') for e in seen] == ['a', 'c']
+
+
+def test_database_visit_in_parallel(tmp_path):
+    db_path = tmp_path / 'db.sfm'
+    db_path.write_text(
+        ''.join(f'\\lx e{i}\n\\sd a__b\n\\pc img{i}.jpg\n\n' for i in range(20)),
+        encoding='utf8')
+    serial, parallel = sfm_lib.Database(db_path), sfm_lib.Database(db_path)
+    serial_files, parallel_files = sfm_lib.Files({}, []), sfm_lib.Files({}, [])
+
+    serial.visit(sfm_lib.VisitorChain(sfm_lib.normalize, serial_files))
+    parallel.visit(
+        sfm_lib.VisitorChain(sfm_lib.normalize, parallel_files), workers=2)
+    assert parallel == serial
+    assert parallel[0].get('sd') == 'a b'
+    assert len(parallel_files.missing_files) == 20
+    assert parallel_files.missing_files == serial_files.missing_files
+
+
 def test_comparisonmeanings_obj(mocker):
     class Concepticon:
         conceptsets = {1: mocker.Mock(id='1', gloss='gloss', definition='definition')}
@@ -44,6 +77,44 @@ def test_comparisonmeanings_obj(mocker):
     assert 'gloss' in e.get('zcom2')
 
 
+def test_comparisonmeanings_prepare(mocker, tmp_path):
+    for name in ['mappings/map-en.tsv', 'concepticondata/concepticon.tsv']:
+        (tmp_path / name).parent.mkdir()
+        (tmp_path / name).write_text('ID\tGLOSS\n1\tgloss\n')
+
+    class Concepticon:
+        repos = tmp_path
+        conceptsets = {'1': mocker.Mock(id='1', gloss='gloss', definition='definition')}
+        lookup = mocker.Mock(side_effect=lambda comps, **_kw: [
+            {(comp, '1')} if comp == 'meaning' else set() for comp in comps])
+
+    def entries():
+        return [
+            sfm_lib.Entry([('lx', 'a'), ('de', 'meaning')]),
+            sfm_lib.Entry([('lx', 'b'), ('de', 'other ; Meaning')]),
+            sfm_lib.Entry([('lx', 'c'), ('de', 'meaning')]),
+            sfm_lib.Entry([('lx', 'd')])]
+
+    concepticon = Concepticon()
+    cm = sfm_lib.ComparisonMeanings(concepticon, cache_dir=tmp_path / 'cache')
+    db = entries()
+    cm.prepare(db)
+    assert concepticon.lookup.call_count == 2
+    assert concepticon.lookup.call_args_list[1][0][0] == ['meaning', 'other']
+    for entry in db:
+        cm(entry)
+    assert concepticon.lookup.call_count == 2
+    assert [e.get('zcom2') for e in db] == ['gloss [1] "definition"'] * 3 + [None]
+
+    cm = sfm_lib.ComparisonMeanings(concepticon, cache_dir=tmp_path / 'cache')
+    db = entries()
+    cm.prepare(db)
+    for entry in db:
+        cm(entry)
+    assert concepticon.lookup.call_count == 2
+    assert [e.get('zcom2') for e in db] == ['gloss [1] "definition"'] * 3 + [None]
+
+
 class ExampleExtraction(unittest.TestCase):
 
     def test_separate_examples_from_entry(self):
@@ -73,10 +144,10 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example = examples[0]
         self.assertEqual(example, [
-            ('ref', example.id),
             ('tx', 'primary text'),
             ('ft', 'translation'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example.id)])
 
     def test_generation_of_lemma_marker(self):
         # Side Question: Is it bad that the lemma marker is appended to the end?
@@ -90,10 +161,10 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example = examples[0]
         self.assertEqual(example, [
-            ('ref', example.id),
             ('tx', 'primary text'),
             ('ft', 'translation'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example.id)])
 
     def test_merging_of_lemma_marker(self):
         example_markers = {'lemma', 'xv', 'xe'}
@@ -107,10 +178,10 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example = examples[0]
         self.assertEqual(example, [
-            ('ref', example.id),
             ('lemma', 'other_headword ; headword'),
             ('tx', 'primary text'),
-            ('ft', 'translation')])
+            ('ft', 'translation'),
+            ('ref', example.id)])
 
     def test_multiple_examples(self):
         example_markers = {'xv', 'xe'}
@@ -127,22 +198,61 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('tx', 'primary text 1'),
             ('ft', 'translation 1'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
         example2 = examples[1]
         self.assertEqual(example2, [
-            ('ref', example2.id),
             ('tx', 'primary text 2'),
             ('ft', 'translation 2'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example2.id)])
         example3 = examples[2]
         self.assertEqual(example3, [
-            ('ref', example3.id),
             ('tx', 'primary text 3'),
             ('ft', 'translation 3'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example3.id)])
+
+    def test_merging_of_conflicting_examples(self):
+        example_markers = {'rf', 'xv', 'xe'}
+        log = Mock()
+        extractor = sfm_lib.ExampleExtractor(example_markers, {}, log)
+        sources = [('a', 'source 1'), ('b', 'source 2'), ('c', None), ('d', 'source 2')]
+        for headword, source in sources:
+            entry = Entry([('lx', headword), ('xv', 'primary text'), ('xe', 'translation')])
+            if source:
+                entry.insert(1, ('rf', source))
+            extractor(entry)
+        example1, example2 = extractor.examples.values()
+        self.assertEqual(example2.id, example1.id + '---1')
+        self.assertEqual(example1.get('lemma'), 'a ; c')
+        self.assertEqual(example2.get('lemma'), 'b ; d')
+        self.assertEqual(log.write.call_count, 2)
+        self.assertTrue(log.write.call_args[0][0].startswith('# cannot merge \\rf:'))
+
+    def test_merging_into_later_variants(self):
+        example_markers = {'rf', 'xv', 'xe'}
+        log = Mock()
+        extractor = sfm_lib.ExampleExtractor(example_markers, {}, log)
+        sources = ['source 1', 'source 2', 'source 3', 'source 2', 'source 3']
+        for headword, source in zip('abcde', sources):
+            extractor(Entry([
+                ('lx', headword), ('rf', source), ('xv', 'primary text'), ('xe', 'translation')]))
+        example1, example2, example3 = extractor.examples.values()
+        self.assertEqual(
+            [example2.id, example3.id], [example1.id + '---1', example1.id + '---2'])
+        self.assertEqual(
+            [ex.get('lemma') for ex in (example1, example2, example3)],
+            ['a', 'b ; d', 'c ; e'])
+        # Every example it disagrees with is logged, before an example is merged.
+        self.assertEqual(log.write.call_count, 6)
+        message = log.write.call_args[0][0]
+        self.assertTrue(message.startswith('# cannot merge \\rf:\n\\ref {}---1\n'.format(
+            example1.id)))
+        self.assertIn('# and\n\\ref {}---1\n\\lemma e\n\\rf source 3\n'.format(
+            example1.id), message)
 
     def test_there_might_be_stuff_before_xv(self):
         example_markers = {'rf', 'xv', 'xe'}
@@ -162,25 +272,25 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('rf', 'source 1'),
             ('tx', 'primary text 1'),
             ('ft', 'translation 1'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
         example2 = examples[1]
         self.assertEqual(example2, [
-            ('ref', example2.id),
             ('rf', 'source 2'),
             ('tx', 'primary text 2'),
             ('ft', 'translation 2'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example2.id)])
         example3 = examples[2]
         self.assertEqual(example3, [
-            ('ref', example3.id),
             ('rf', 'source 3'),
             ('tx', 'primary text 3'),
             ('ft', 'translation 3'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example3.id)])
 
     def test_there_might_be_stuff_after_xe(self):
         example_markers = {'xv', 'xe', 'z0'}
@@ -200,25 +310,25 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('tx', 'primary text 1'),
             ('ft', 'translation 1'),
             ('z0', 'gloss ref 1'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
         example2 = examples[1]
         self.assertEqual(example2, [
-            ('ref', example2.id),
             ('tx', 'primary text 2'),
             ('ft', 'translation 2'),
             ('z0', 'gloss ref 2'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example2.id)])
         example3 = examples[2]
         self.assertEqual(example3, [
-            ('ref', example3.id),
             ('tx', 'primary text 3'),
             ('ft', 'translation 3'),
             ('z0', 'gloss ref 3'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example3.id)])
 
     def test_missing_xe(self):
         example_markers = {'xv', 'xe'}
@@ -237,16 +347,16 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('tx', 'primary text 1'),
             ('ft', 'translation 1'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
         example3 = examples[1]
         self.assertEqual(example3, [
-            ('ref', example3.id),
             ('tx', 'primary text 3'),
             ('ft', 'translation 3'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example3.id)])
 
         with self.assertRaises(AssertionError):
             log.write.assert_not_called()
@@ -268,12 +378,12 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('tx', 'primary text 1 primary text 1b'),
             ('mid1', 'mid1 1'),
             ('mid2', 'mid2 1'),
             ('ft', 'translation 1'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
 
     def test_rf_in_the_middle(self):
         example_markers = {'rf', 'xv', 'mid1', 'mid2', 'xe'}
@@ -294,12 +404,12 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('rf', 'source 2'),
             ('tx', 'primary text 2'),
             ('mid2', 'mid2 2'),
             ('ft', 'translation 2'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
 
         with self.assertRaises(AssertionError):
             log.write.assert_not_called()
@@ -321,16 +431,16 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('tx', 'primary text 1'),
             ('ft', 'translation 1'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
         example3 = examples[1]
         self.assertEqual(example3, [
-            ('ref', example3.id),
             ('tx', 'primary text 3'),
             ('ft', 'translation 3'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example3.id)])
 
         with self.assertRaises(AssertionError):
             log.write.assert_not_called()
@@ -355,18 +465,18 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('rf', 'source 1'),
             ('tx', 'primary text 1'),
             ('ft', 'translation 1'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
         example3 = examples[1]
         self.assertEqual(example3, [
-            ('ref', example3.id),
             ('rf', 'source 3'),
             ('tx', 'primary text 3'),
             ('ft', 'translation 3'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example3.id)])
 
         with self.assertRaises(AssertionError):
             log.write.assert_not_called()
@@ -391,21 +501,62 @@ class ExampleExtraction(unittest.TestCase):
         examples = list(extractor.examples.values())
         example1 = examples[0]
         self.assertEqual(example1, [
-            ('ref', example1.id),
             ('tx', 'primary text 1'),
             ('other_marker', 'other marker 1'),
             ('ft', 'translation 1'),
             # Note: trailing stuff ends up in the previous example, because we
             # never know, when an example *truly* ends
             ('other_marker', 'other marker 2'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example1.id)])
         example3 = examples[1]
         self.assertEqual(example3, [
-            ('ref', example3.id),
             ('tx', 'primary text 3'),
             ('other_marker', 'other marker 3'),
             ('ft', 'translation 3'),
-            ('lemma', 'headword')])
+            ('lemma', 'headword'),
+            ('ref', example3.id)])
 
         with self.assertRaises(AssertionError):
             log.write.assert_not_called()
+
+
+def test_files_index(tmp_path):
+    catalog = {
+        'md5-1': {'sid': 'dict', 'type': 'image', 'fname': 'Фото.JPG'},
+        'md5-2': {'sid': 'dict', 'type': 'audio', 'fname': 'a.wav'},
+        'md5-3': {'sid': 'other', 'type': 'audio', 'fname': 'b.wav'},
+    }
+    expected = sfm_lib.Files(catalog, ['dict']).files
+    assert expected['image']['Foto.JPG'] == 'md5-1'
+    assert sfm_lib.Files(catalog, ['dict'], cache_dir=tmp_path).files == expected
+    cached = sfm_lib.Files(catalog, ['dict'], cache_dir=tmp_path)
+    assert cached.files == expected
+
+    catalog['md5-4'] = {'sid': 'dict', 'type': 'audio', 'fname': 'a.wav'}
+    files = sfm_lib.Files(catalog, ['dict'], cache_dir=tmp_path)
+    assert files.files['audio']['a'] == 'md5-4'
+    entry = files(sfm_lib.Entry([('lx', 'a'), ('sf', r'dir\a.WAV ; b.wav'), ('pc', 'фото.jpg')]))
+    assert entry.get('sf') == 'md5-4'
+    assert entry.get('pc') == ''
+    assert files.missing_files == {('a', 'sf', 'b.wav'), ('a', 'pc', 'фото.jpg')}
+
+
+def test_media_resolver(mocker):
+    catalog = {
+        'md5-1': {'sid': 'dict', 'type': 'audio', 'fname': 'a.b.wav'},
+        'md5-2': {'sid': 'other', 'type': 'audio', 'fname': 'c.wav'},
+    }
+    media = sfm_lib.MediaResolver(catalog, ['dict'])
+    assert media.lookup('a.b', ['image', 'audio']) == 'md5-1'
+    assert media.lookup('a.b.wav', ['image']) is None
+    assert media.resolve('md5-2') == ('c.wav', 'md5-2')
+    assert media.resolve('a') == ('a', 'md5-1')
+    assert media.resolve('c.wav') == ('c.wav', 'c.wav')
+    assert 'md5-1' in media and media['md5-1']['fname'] == 'a.b.wav'
+
+    files = sfm_lib.Files(resolver=media)
+    files(sfm_lib.Entry([('lx', 'x'), ('sf', 'd.wav')]))
+    log = mocker.Mock()
+    media.report(log)
+    assert [c.args[1] for c in log.warning.call_args_list] == ["'d.wav'", "'c.wav'"]
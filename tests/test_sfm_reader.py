@@ -0,0 +1,72 @@
+import pytest
+from clldutils.sfm import SFM
+
+from pydictionaria.sfm_reader import iter_blocks, read_entries, read_into
+
+SFM_TEXT = """\\_sh v3.0  400  MDF 4.0
+\\_DateStampHasFourDigitYear
+
+\\lx  first \t
+\\hm 1
+\\de a value
+  spanning
+\\_header inside the entry
+
+  lines
+\\lx-not-a-marker
+\\ge\u00a0gloss
+\\xv
+\\nt
+\\_header after an empty line
+
+\\lx second
+\\ps n
+"""
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n', '\r'])
+@pytest.mark.parametrize('entry_sep', ['\\lx ', '\n\n'])
+@pytest.mark.parametrize('keep_empty', [False, True])
+def test_read_entries(tmp_path, newline, entry_sep, keep_empty):
+    path = tmp_path / 'db.sfm'
+    path.write_bytes(SFM_TEXT.replace('\n', newline).encode('utf-8'))
+    kw = dict(marker_map={'ge': 'gn'}, entry_sep=entry_sep, keep_empty=keep_empty)
+    expected = SFM()
+    expected.read(path, **kw)
+    assert list(read_entries(path, **kw)) == list(expected)
+
+
+def test_iter_blocks(tmp_path):
+    path = tmp_path / 'db.sfm'
+    path.write_bytes('\\lx é\n\\lx b\n'.encode('utf-8'))
+    assert list(iter_blocks(path, '\\lx ')) == [(0, 0, ''), (4, 7, 'é\n'), (11, 13, 'b\n')]
+    path.write_bytes(b'')
+    assert list(iter_blocks(path, '\\lx ')) == [(0, 0, '')]
+
+
+@pytest.mark.parametrize('encoding', ['latin-1', 'utf-16'])
+def test_read_into(tmp_path, encoding):
+    path = tmp_path / 'db.sfm'
+    path.write_text('\\lx ä\n\\ps n\n\n\\lx b\n', encoding=encoding)
+    sfm = SFM()
+    read_into(sfm, path, encoding=encoding, entry_sep='\\lx ')
+    assert [e.get('lx') for e in sfm] == ['ä', 'b']
+
+
+def test_read_into_cache(tmp_path):
+    path = tmp_path / 'db.sfm'
+    path.write_text('\\lx a\n\\ps n\n\\lx b\n', encoding='utf-8')
+    cache_dir = tmp_path / 'cache'
+
+    def read(**kw):
+        sfm = SFM()
+        read_into(sfm, path, entry_sep='\\lx ', cache_dir=cache_dir, **kw)
+        return [e[0] for e in sfm]
+
+    assert read() == [('lx', 'a'), ('lx', 'b')]
+    assert len(list(cache_dir.iterdir())) == 1
+    assert read() == [('lx', 'a'), ('lx', 'b')]
+    assert read(marker_map={'lx': 'hw'}) == [('hw', 'a'), ('hw', 'b')]
+
+    path.write_text('\\lx a\n\\ps n\n\\lx b\n\\lx c\n', encoding='utf-8')
+    assert read() == [('lx', 'a'), ('lx', 'b'), ('lx', 'c')]
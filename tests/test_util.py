@@ -1,11 +1,60 @@
+import copy
+import pickle
+
+import pytest
 from cdstarcat.catalog import Object, Bitstream
-from pydictionaria.util import MediaCatalog, split_ids
+from clldutils.path import md5
+from pydictionaria.util import (
+    ChecksumCache, IndexedEntry, MediaCatalog, read_cache, split_ids, write_cache,
+)
 
 
 def test_split_ids():
     assert split_ids('c, b; b, a.') == ['a.', 'b', 'c']
 
 
+class _Entry(IndexedEntry):
+    __slots__ = ('id',)
+
+
+@pytest.mark.parametrize('threshold', [0, 64])
+def test_indexed_entry(monkeypatch, threshold):
+    monkeypatch.setattr(_Entry, 'index_threshold', threshold)
+    entry = _Entry([('a', '1'), ('b', '2'), ('a', '3')])
+    assert entry.get('a') == '1'
+    assert entry.getall('a') == ['1', '3']
+    assert entry.get('c', 'x') == 'x'
+
+    entry.append(('c', '4'))
+    assert entry.get('c') == '4'
+    entry[0] = ('d', '0')
+    assert entry.getall('a') == ['3']
+    entry.insert(0, ('a', '5'))
+    assert entry.positions('a') == [0, 3]
+    del entry[0]
+    entry += [('a', '6')]
+    assert entry.getall('a') == ['3', '6']
+
+    entry.id = 'id'
+    for other in [copy.copy(entry), pickle.loads(pickle.dumps(entry))]:
+        assert other == entry
+        assert other.id == 'id'
+        other.pop()
+        assert other.getall('a') == ['3']
+    assert entry.getall('a') == ['3', '6']
+    assert not hasattr(_Entry(), 'id')
+
+
+def test_cache(tmp_path):
+    path = tmp_path / 'cache' / 'data.pickle'
+    assert read_cache(path, 'key') is None
+    write_cache(path, 'key', {'a': [1, 2]})
+    assert read_cache(path, 'key') == {'a': [1, 2]}
+    assert read_cache(path, 'other key') is None
+    path.write_bytes(b'garbage')
+    assert read_cache(path, 'key') is None
+
+
 def test_mediacatalog_obj(tmpdir):
     with MediaCatalog(str(tmpdir)) as mcat:
         assert 'md5' not in mcat
@@ -19,3 +68,24 @@ def test_mediacatalog_obj(tmpdir):
 
     mcat = MediaCatalog(str(tmpdir))
     assert 'md5' in mcat
+
+
+def test_checksum_cache(tmp_path, mocker):
+    paths = []
+    for i in range(5):
+        paths.append(tmp_path / f'{i}.wav')
+        paths[-1].write_bytes(str(i).encode() * 100000)
+    cache_path = tmp_path / 'cache' / 'checksums'
+
+    with ChecksumCache(cache_path) as checksums:
+        assert list(checksums.map(paths, workers=2)) == [(p, md5(p)) for p in paths]
+    checksums = pickle.loads(pickle.dumps(ChecksumCache(cache_path)))
+    hashed = mocker.patch('pydictionaria.util._md5_file', return_value='x')
+    assert checksums.md5(paths[0]) == md5(paths[0])
+    assert not checksums.changed and not hashed.called
+
+    paths[0].write_bytes(b'changed')
+    assert checksums.md5(paths[0]) == 'x'
+    other = ChecksumCache(cache_path)
+    other.merge(checksums)
+    assert other.md5(paths[0]) == 'x'